@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+自动换行基准测试
+对比旧版（逐位置回扫标签，最坏二次方复杂度）与 translation_tool 中的线性换行实现，
+校验两者输出完全一致并输出耗时。
+
+用法:
+    python bench_wrap.py [CSV目录] [--width 字数] [--repeat 次数]
+CSV目录默认为 csv_export；目录中没有翻译时使用合成的长文本。
+"""
+import os
+import re
+import sys
+import time
+import random
+
+from translation_tool import (
+    CN_TARGET_LANG, parse_language_csv, clean_control_chars,
+    _wrap_single_line, _WRAP_BREAK_AFTER, _WRAP_NO_LINE_START,
+)
+
+
+# ==================== 旧版实现（仅用于对比） ====================
+
+def legacy_display_width(text):
+    clean = re.sub(r'\[/?[^\]]*\]', '', text)
+    clean = re.sub(r'\{[^\}]*\}', 'XX', clean)
+    return sum(2 if ord(c) > 0x2E80 else 1 for c in clean)
+
+
+def legacy_is_inside_tag(text, pos):
+    depth_sq = depth_br = 0
+    for i in range(pos, -1, -1):
+        if text[i] == ']': depth_sq += 1
+        elif text[i] == '[':
+            depth_sq -= 1
+            if depth_sq < 0: return True
+        elif text[i] == '}': depth_br += 1
+        elif text[i] == '{':
+            depth_br -= 1
+            if depth_br < 0: return True
+    return False
+
+
+def legacy_find_break_point(line):
+    end = len(line) - 2
+    if end < 0:
+        return -1
+    start = max(0, end - 25)
+    for j in range(end, start, -1):
+        ch = line[j]
+        if (ch in _WRAP_BREAK_AFTER or ch == ' ') and not legacy_is_inside_tag(line, j):
+            return j + 1
+    for j in range(end, start, -1):
+        if ord(line[j]) > 0x2E80 and line[j] not in _WRAP_NO_LINE_START and not legacy_is_inside_tag(line, j):
+            return j + 1
+    return -1
+
+
+def legacy_wrap_single_line(text, max_width):
+    if legacy_display_width(text) <= max_width:
+        return text
+    result = []
+    line = ''
+    width = 0
+    in_tag = False
+    tag_end_char = ''
+    for i, c in enumerate(text):
+        if not in_tag and c in '[{':
+            in_tag = True
+            tag_end_char = ']' if c == '[' else '}'
+        is_end = in_tag and c == tag_end_char
+        if is_end:
+            in_tag = False
+        if in_tag or c in '[]{}':
+            line += c
+            if is_end and re.search(r'\[img:[^\]]*\]$', line):
+                width += 2
+            continue
+        width += 2 if ord(c) > 0x2E80 else 1
+        line += c
+        if width >= max_width and not in_tag:
+            bp = legacy_find_break_point(line)
+            if bp > 0:
+                while bp < len(line) and line[bp] in _WRAP_NO_LINE_START:
+                    bp += 1
+                if bp < len(line):
+                    result.append(line[:bp])
+                    line = line[bp:]
+                    width = legacy_display_width(line)
+    if line:
+        result.append(line)
+    return '\n'.join(result)
+
+
+# ==================== 测试数据 ====================
+
+def load_corpus_lines(csv_dir):
+    """读取目录中所有CSV的中文列，按行拆分"""
+    lines = []
+    if not os.path.isdir(csv_dir):
+        return lines
+    for fname in sorted(os.listdir(csv_dir)):
+        if not fname.endswith('.csv'):
+            continue
+        with open(os.path.join(csv_dir, fname), 'rb') as f:
+            table = parse_language_csv(f.read())
+        if table is None or CN_TARGET_LANG not in table.columns:
+            continue
+        for text in table.columns[CN_TARGET_LANG]:
+            if text:
+                lines.extend(clean_control_chars(text).split('\n'))
+    return lines
+
+
+def synthetic_lines(count=300, seed=1):
+    """合成带少量标签的长叙事文本
+
+    末尾附加一行以 {[} 开头的长文本：其中的候选断点都被判定在标签内，
+    旧版每个字符都要回扫到行首，退化为二次方。
+    """
+    rng = random.Random(seed)
+    han = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+    tags = ['[b]护盾[/b]', '{catname}', '[img:heart]', '[s:2]层数[/s]', ' Bleed ']
+
+    def sentence():
+        s = ''.join(rng.choice(han) for _ in range(rng.randint(4, 20)))
+        if rng.random() < 0.2:
+            s += rng.choice(tags)
+        return s + rng.choice('，。！？')
+
+    lines = [''.join(sentence() for _ in range(rng.randint(5, 60))) for _ in range(count)]
+    lines.append('{[}' + ''.join(rng.choice(han) for _ in range(800)))
+    return lines
+
+
+def bench(fn, lines, width, repeat):
+    best = None
+    out = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = [fn(line, width) for line in lines]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, out
+
+
+def main():
+    args = sys.argv[1:]
+    width_chars = 15
+    repeat = 3
+    if '--width' in args:
+        i = args.index('--width')
+        width_chars = int(args[i + 1])
+        del args[i:i + 2]
+    if '--repeat' in args:
+        i = args.index('--repeat')
+        repeat = int(args[i + 1])
+        del args[i:i + 2]
+    csv_dir = args[0] if args else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv_export')
+    width = width_chars * 2
+
+    lines = load_corpus_lines(csv_dir)
+    source = csv_dir
+    if not lines:
+        lines = synthetic_lines()
+        source = '合成文本'
+    total_chars = sum(len(l) for l in lines)
+    print(f"数据: {source}  {len(lines)} 行 / {total_chars} 字符  换行宽度: {width}")
+
+    t_old, out_old = bench(legacy_wrap_single_line, lines, width, repeat)
+    t_new, out_new = bench(_wrap_single_line, lines, width, repeat)
+    diff = sum(1 for a, b in zip(out_old, out_new) if a != b)
+    print(f"旧版: {t_old * 1000:.1f} ms")
+    print(f"新版: {t_new * 1000:.1f} ms  (加速 {t_old / t_new:.1f}x)")
+    print(f"输出一致: {'是' if diff == 0 else f'否，{diff} 行不同'}")
+    return 0 if diff == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -446,6 +446,58 @@ def parse_swf_tags(swf_data):
     }
 
 
+def read_font_advances(ttf_path):
+    """读取TTF/OTF字体各码点的advance width，返回 ({码点: 宽度}, unitsPerEm)"""
+    font = TTFont(ttf_path, lazy=True)
+    try:
+        units_per_em = font['head'].unitsPerEm
+        cmap = font.getBestCmap() or {}
+        metrics = font['hmtx'].metrics
+        advances = {}
+        for cp, glyph_name in cmap.items():
+            if glyph_name in metrics:
+                advances[cp] = metrics[glyph_name][0]
+        return advances, units_per_em
+    finally:
+        font.close()
+
+
+def read_swf_advances(swf_data):
+    """读取SWF中DefineFont3的AdvanceTable，返回 ({码点: 宽度}, 每em单位数)
+
+    DefineFont3的字形坐标为20倍的1024单位/em。没有布局信息时返回空表。
+    """
+    orig = parse_swf_tags(swf_data)
+    for tag_type, data in orig['tags']:
+        if tag_type != 75:
+            continue
+        flags = data[2]
+        has_layout = flags & 0x80
+        wide_offsets = flags & 0x08
+        wide_codes = flags & 0x04
+        pos = 5 + data[4]
+        num_glyphs = struct.unpack('<H', data[pos:pos+2])[0]
+        pos += 2
+        table_start = pos
+        if wide_offsets:
+            code_offset = struct.unpack('<I', data[pos + num_glyphs*4:pos + num_glyphs*4 + 4])[0]
+        else:
+            code_offset = struct.unpack('<H', data[pos + num_glyphs*2:pos + num_glyphs*2 + 2])[0]
+        pos = table_start + code_offset
+        if wide_codes:
+            codes = struct.unpack(f'<{num_glyphs}H', data[pos:pos + num_glyphs*2])
+            pos += num_glyphs * 2
+        else:
+            codes = tuple(data[pos:pos + num_glyphs])
+            pos += num_glyphs
+        if not has_layout:
+            return {}, 20480
+        pos += 6  # FontAscent, FontDescent, FontLeading
+        widths = struct.unpack(f'<{num_glyphs}h', data[pos:pos + num_glyphs*2])
+        return dict(zip(codes, widths)), 20480
+    return {}, 20480
+
+
 def convert_font_to_swf(ttf_path, original_swf_bytes, progress_cb=None):
     """
     将TTF/OTF字体转换为SWF，使用原始unicodefont.swf的骨架结构。
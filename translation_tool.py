@@ -14,8 +14,16 @@ import re
 import shutil
 import time
 import glob
+import hashlib
 import threading
+import asyncio
+import queue
+import random
 import warnings
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from mewgenics_cn_patch import OVERRIDE_LANGUAGES
 warnings.filterwarnings("ignore", message=".*timestamp.*")
 
 VERSION = "1.1"
@@ -33,6 +41,8 @@ AI_PROVIDERS = [
 
 # 游戏 CSV 中的中文列名
 CN_TARGET_LANG = 'schinese'
+# 繁体输出列名（简转繁）
+TC_TARGET_LANG = 'tchinese'
 
 # 不允许AI翻译覆盖的特殊key（语言配置等）
 PROTECTED_KEYS = {
@@ -209,57 +219,356 @@ def get_first_field(row_text):
     return row_text[:comma_pos].strip()
 
 
-def extract_all_languages(gpak_path):
-    """从GPAK提取所有CSV的所有语言列
-    返回 {csv_name: {KEY: {lang: text}}}
+def is_text_csv(name):
+    """GPAK内的条目是否为游戏文本CSV"""
+    return name.startswith('data/text/') and name.endswith('.csv')
+
+
+def read_gpak_files(gpak_path, entries, data_start, names):
+    """一次打开GPAK按偏移顺序读取多个文件，返回 {name: bytes}"""
+    wanted = set(names)
+    result = {}
+    offset = data_start
+    with open(gpak_path, 'rb') as f:
+        for entry in entries:
+            if entry['name'] in wanted:
+                f.seek(offset)
+                result[entry['name']] = f.read(entry['size'])
+            offset += entry['size']
+    return result
+
+
+class CorpusRow:
+    """CorpusTable中一行的只读视图，兼容原 {lang: text} 字典的常用读取方式"""
+    __slots__ = ('_table', '_row')
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def get(self, lang, default=None):
+        col = self._table.columns.get(lang)
+        if col is None:
+            return default
+        return col[self._row] or default
+
+    def __getitem__(self, lang):
+        val = self.get(lang)
+        if val is None:
+            raise KeyError(lang)
+        return val
+
+    def __contains__(self, lang):
+        return self.get(lang) is not None
+
+    def keys(self):
+        return [lang for lang in self._table.columns if self.get(lang) is not None]
+
+    def items(self):
+        return [(lang, self.get(lang)) for lang in self.keys()]
+
+
+class CorpusTable:
+    """单个CSV的列式存储：KEY数组 + 每种语言一个字符串数组 + KEY→行号索引
+
+    取代 {KEY: {lang: text}} 的嵌套字典（每行一个小dict），空值统一存为''，
+    相同文本共享同一个字符串对象。按Mapping方式访问时返回 CorpusRow 视图。
     """
-    with open(gpak_path, 'rb') as fs:
-        entries, data_start = read_gpak_index(fs)
+    __slots__ = ('keys_list', 'columns', 'index')
+
+    def __init__(self, langs=()):
+        self.keys_list = []
+        self.columns = {lang: [] for lang in langs}
+        self.index = {}
+
+    def append(self, key, values):
+        """追加一行，values与构造时的语言顺序对应；重复KEY覆盖原行"""
+        row = self.index.get(key)
+        if row is None:
+            self.index[key] = len(self.keys_list)
+            self.keys_list.append(key)
+            for col, val in zip(self.columns.values(), values):
+                col.append(val)
+        else:
+            for col, val in zip(self.columns.values(), values):
+                col[row] = val
+
+    def get_text(self, key, lang, default=''):
+        """读取单元格文本，空值返回default"""
+        row = self.index.get(key)
+        col = self.columns.get(lang)
+        if row is None or col is None:
+            return default
+        return col[row] or default
+
+    def column(self, lang):
+        """返回某语言整列（与keys_list按行对齐），不存在时返回全空列"""
+        col = self.columns.get(lang)
+        return col if col is not None else [''] * len(self.keys_list)
+
+    def count_nonempty(self, lang):
+        return sum(1 for v in self.column(lang) if v)
+
+    # ---- Mapping兼容接口 ----
+    def __len__(self):
+        return len(self.keys_list)
+
+    def __iter__(self):
+        return iter(self.keys_list)
 
-    all_data = {}
-    for entry in entries:
-        name = entry['name']
-        if not name.startswith('data/text/') or not name.endswith('.csv'):
+    def __contains__(self, key):
+        return key in self.index
+
+    def __getitem__(self, key):
+        return CorpusRow(self, self.index[key])
+
+    def get(self, key, default=None):
+        row = self.index.get(key)
+        return default if row is None else CorpusRow(self, row)
+
+    def keys(self):
+        return list(self.keys_list)
+
+    def items(self):
+        return [(key, CorpusRow(self, row)) for row, key in enumerate(self.keys_list)]
+
+    def values(self):
+        return [CorpusRow(self, row) for row in range(len(self.keys_list))]
+
+
+def parse_language_csv(raw):
+    """解析单个CSV的原始字节，返回 CorpusTable"""
+    text = raw.decode('utf-8-sig')
+    rows = split_csv_logical_rows(text)
+    if not rows:
+        return None
+
+    header_fields = split_csv_fields(rows[0].rstrip('\r\n'))
+    lang_cols = {}
+    for idx, f in enumerate(header_fields):
+        col_name = f.strip().lower()
+        if idx == 0 or col_name in ('notes', '') :
+            continue
+        lang_cols[idx] = col_name
+
+    # 列名重复时以后出现的列为准（与原字典实现一致）
+    col_by_lang = {}
+    for col_idx, lang_name in lang_cols.items():
+        col_by_lang[lang_name] = col_idx
+    table = CorpusTable(col_by_lang.keys())
+    col_order = list(col_by_lang.values())
+    interned = {'': ''}
+    for row in rows[1:]:
+        row_stripped = row.rstrip('\r\n').strip()
+        if not row_stripped or row_stripped.startswith('//'):
+            continue
+        fields = split_csv_fields(row_stripped)
+        if not fields:
             continue
-        csv_name = os.path.basename(name)
-        raw = extract_file_from_gpak(gpak_path, entries, data_start, name)
-        if not raw:
+        key = unquote_csv_field(fields[0])
+        if not key:
             continue
+        values = []
+        for col_idx in col_order:
+            val = unquote_csv_field(fields[col_idx]) if col_idx < len(fields) else ''
+            values.append(interned.setdefault(val, val))
+        table.append(key, values)
+    return table
+
+
+# 多进程解析的分界点：CSV总量小于此值时进程启动开销大于收益，保持单进程
+_PARALLEL_PARSE_MIN_BYTES = 4 * 1024 * 1024
+_PARALLEL_PARSE_MIN_FILES = 4
 
-        text = raw.decode('utf-8-sig')
-        rows = split_csv_logical_rows(text)
-        if not rows:
+
+def parse_csv_files(raw_files, workers=None):
+    """解析多个CSV {csv_name: bytes}，数据量足够大时使用进程池并行
+    返回 {csv_name: CorpusTable}，顺序与输入一致
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(raw_files))
+    total_bytes = sum(len(raw) for raw in raw_files.values())
+    parsed = None
+    if (workers > 1 and len(raw_files) >= _PARALLEL_PARSE_MIN_FILES
+            and total_bytes >= _PARALLEL_PARSE_MIN_BYTES):
+        from concurrent.futures import ProcessPoolExecutor
+        # 大文件先提交，避免尾部只剩一个大文件在跑
+        names = sorted(raw_files, key=lambda n: len(raw_files[n]), reverse=True)
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                parsed = dict(zip(names, pool.map(parse_language_csv, [raw_files[n] for n in names])))
+        except Exception:
+            parsed = None  # 进程池不可用（如受限环境）时回退单进程
+    if parsed is None:
+        parsed = {name: parse_language_csv(raw) for name, raw in raw_files.items()}
+    return {name: parsed[name] for name in raw_files if parsed[name] is not None}
+
+
+def count_csv_rows(raw):
+    """不做完整解析，快速估算CSV数据行数（用于解析前的进度显示）"""
+    count = 0
+    in_quote = False
+    for line in raw.split(b'\n')[1:]:
+        if not in_quote:
+            stripped = line.strip()
+            if stripped and not stripped.startswith(b'//'):
+                count += 1
+        if line.count(b'"') % 2:
+            in_quote = not in_quote
+    return count
+
+
+class LazyCorpus:
+    """按需解析的语料集合 {csv_name: CorpusTable}
+
+    读取GPAK时只保存各CSV的原始字节和估算行数，某个文件第一次被访问
+    （选中查看、加入翻译、勾选打补丁）时才解析；load() 可批量并行解析。
+    """
+
+    def __init__(self, raw_files):
+        self._raw = raw_files
+        self._tables = {}
+        # 未解析文件的单列缓存 {(csv_name, lang): {KEY: text}}，见 text_of()
+        self._columns = {}
+        self._lock = threading.Lock()
+        self.row_counts = {name: count_csv_rows(raw) for name, raw in raw_files.items()}
+
+    def __len__(self):
+        return len(self._raw)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __contains__(self, name):
+        return name in self._raw
+
+    def keys(self):
+        return list(self._raw)
+
+    def __getitem__(self, name):
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                table = parse_language_csv(self._raw[name]) or CorpusTable()
+                self._tables[name] = table
+                self._drop_columns(name)
+            return table
+
+    def get(self, name, default=None):
+        if name not in self._raw:
+            return default
+        return self[name]
+
+    def is_loaded(self, name):
+        return name in self._tables
+
+    def text_of(self, name, key, lang, default=''):
+        """读取单元格文本；文件尚未解析时只扫描KEY列和该语言列，不会触发整表解析"""
+        with self._lock:
+            table = self._tables.get(name)
+            if table is None:
+                col = self._columns.get((name, lang))
+                if col is None:
+                    col = self._columns[(name, lang)] = read_csv_column(self._raw[name], lang) or {}
+        if table is not None:
+            return table.get_text(key, lang, default)
+        return col.get(key) or default
+
+    def raw(self, name):
+        return self._raw.get(name)
+
+    def load(self, names, workers=None):
+        """批量解析尚未加载的文件（数量多时走进程池）"""
+        with self._lock:
+            pending = {n: self._raw[n] for n in names if n in self._raw and n not in self._tables}
+        if not pending:
+            return
+        parsed = parse_csv_files(pending, workers)
+        with self._lock:
+            for name in pending:
+                self._tables.setdefault(name, parsed.get(name) or CorpusTable())
+                self._drop_columns(name)
+
+    def _drop_columns(self, name):
+        # 整表已解析，单列缓存不再需要
+        for cache_key in [k for k in self._columns if k[0] == name]:
+            del self._columns[cache_key]
+
+
+def csv_has_column(raw, col_name):
+    """只看header行判断CSV是否包含某列"""
+    end = raw.find(b'\n')
+    header = raw[:end if end >= 0 else len(raw)].decode('utf-8-sig', errors='replace')
+    return any(f.strip().lower() == col_name for f in split_csv_fields(header))
+
+
+# 逻辑行 / 字段的正则切分（引号内的换行和逗号不切分），供只读一列的快速路径使用
+_CSV_ROW_RE = re.compile(r'(?:[^"\n]+|"[^"]*")*\n?')
+_CSV_FIELD_RE = re.compile(r'(?:[^",]+|"[^"]*")*')
+
+
+def read_csv_column(raw, lang):
+    """只提取KEY列和某一语言列 {KEY: text}，不构建整张表；没有该列时返回None
+
+    用于读取已有翻译、校验原文等只需要一列的场合，比 parse_language_csv 快得多。
+    """
+    if not csv_has_column(raw, lang):
+        return None
+    text = raw.decode('utf-8-sig')
+    rows = _CSV_ROW_RE.findall(text)
+    header = split_csv_fields(rows[0].rstrip('\r\n'))
+    col = None
+    for idx, f in enumerate(header):
+        if idx and f.strip().lower() == lang:
+            col = idx  # 列名重复时以后出现的列为准（与 parse_language_csv 一致）
+    if col is None:
+        return None
+    result = {}
+    for row in rows[1:]:
+        row = row.rstrip('\r\n').strip()
+        if not row or row.startswith('//'):
             continue
+        # 只切到目标列为止
+        fields = []
+        pos = 0
+        while len(fields) <= col:
+            m = _CSV_FIELD_RE.match(row, pos)
+            fields.append(m.group())
+            pos = m.end()
+            if pos >= len(row) or row[pos] != ',':
+                break
+            pos += 1
+        key = unquote_csv_field(fields[0])
+        if key:
+            result[key] = unquote_csv_field(fields[col]) if col < len(fields) else ''
+    return result
 
-        header_fields = split_csv_fields(rows[0].rstrip('\r\n'))
-        lang_cols = {}
-        for idx, f in enumerate(header_fields):
-            col_name = f.strip().lower()
-            if idx == 0 or col_name in ('notes', '') :
-                continue
-            lang_cols[idx] = col_name
 
-        csv_data = {}
-        for row in rows[1:]:
-            row_stripped = row.rstrip('\r\n').strip()
-            if not row_stripped or row_stripped.startswith('//'):
-                continue
-            fields = split_csv_fields(row_stripped)
-            if not fields:
-                continue
-            key = unquote_csv_field(fields[0])
-            if not key:
-                continue
-            langs = {}
-            for col_idx, lang_name in lang_cols.items():
-                if col_idx < len(fields):
-                    val = unquote_csv_field(fields[col_idx])
-                    if val:
-                        langs[lang_name] = val
-            csv_data[key] = langs
-        all_data[csv_name] = csv_data
+def translations_from_csv(raw, lang=CN_TARGET_LANG):
+    """从CSV原始字节提取已有翻译 {KEY: text}（只读KEY列和中文列），受保护的key使用固定值"""
+    trans = {}
+    for key, val in (read_csv_column(raw, lang) or {}).items():
+        val = val.strip()
+        if key in PROTECTED_KEYS:
+            trans[key] = PROTECTED_KEYS[key]
+        elif val:
+            trans[key] = val
+    return trans
+
 
-    return all_data, entries, data_start
+def open_corpus(gpak_path):
+    """读取GPAK索引和文本CSV原始字节，返回 (LazyCorpus, entries, data_start)"""
+    with open(gpak_path, 'rb') as fs:
+        entries, data_start = read_gpak_index(fs)
+    names = [e['name'] for e in entries if is_text_csv(e['name'])]
+    raw_by_name = read_gpak_files(gpak_path, entries, data_start, names)
+    raw_files = {}
+    for name in names:
+        raw = raw_by_name.get(name)
+        if raw:
+            raw_files[os.path.basename(name)] = raw
+    return LazyCorpus(raw_files), entries, data_start
 
 
 # ==================== 自动换行 ====================
@@ -268,75 +577,212 @@ _WRAP_MAX_WIDTH = 20
 _WRAP_BREAK_AFTER = set('。！？；：，、）】」』》~')
 _WRAP_NO_LINE_START = set('。！？；：，、）】」』》~.!?,;:)]}\'\"')
 
+_WRAP_WINDOW = 25  # 断行点只在行尾这么多个字符内查找
+# 按状态机划分的标签：[...]、{...}（未闭合则到行尾）以及游离的 ] }
+_WRAP_TAG_RE = re.compile(r'\[[^\]]*\]?|\{[^}]*\}?|[\]}]')
+_WRAP_BRACKET_RE = re.compile(r'[\[\]{}]')
+_WRAP_SQ_DELTA = {'[': 1, ']': -1, '{': 0, '}': 0}
+_WRAP_BR_DELTA = {'[': 0, ']': 0, '{': 1, '}': -1}
+_WRAP_BREAK1_RE = re.compile('[' + re.escape(''.join(sorted(_WRAP_BREAK_AFTER))) + ' ]')
+
+
+# 显示宽度以 1/16 em 为单位：全角16，半角8（换行宽度参数仍按半角字符数计）
+_WIDTH_HALF = 8
+_WIDTH_FULL = 16
+_WIDTH_PLACEHOLDER = '\ue000'  # {变量} 替换成的占位符，固定按全角计
+
+
+class CharWidthTable(dict):
+    """字符→显示宽度（1/16 em）的查找表，未见过的字符首次查询时计算并缓存
+
+    advances: 长度0x10000的bytearray（BMP码点→宽度，0表示字体中没有），
+    为None或查不到时按码点估算：U+2E80以上为全角，其余为半角。
+    """
+
+    def __init__(self, advances=None, source=''):
+        super().__init__()
+        self.advances = advances
+        self.source = source
+
+    def __missing__(self, c):
+        cp = ord(c)
+        w = 0
+        if self.advances is not None and cp < len(self.advances) and c != _WIDTH_PLACEHOLDER:
+            w = self.advances[cp]
+        if not w:
+            w = _WIDTH_FULL if cp > 0x2E80 else _WIDTH_HALF
+        self[c] = w
+        return w
+
+
+_CHAR_WIDTHS = CharWidthTable()
+_DW_SQ_TAG_RE = re.compile(r'\[/?[^\]]*\]')
+_DW_BRACE_TAG_RE = re.compile(r'\{[^\}]*\}')
+
+
 def _display_width(text):
-    clean = re.sub(r'\[/?[^\]]*\]', '', text)
-    clean = re.sub(r'\{[^\}]*\}', 'XX', clean)
-    return sum(2 if ord(c) > 0x2E80 else 1 for c in clean)
-
-def _is_inside_tag(text, pos):
-    depth_sq = depth_br = 0
-    for i in range(pos, -1, -1):
-        if text[i] == ']': depth_sq += 1
-        elif text[i] == '[':
-            depth_sq -= 1
-            if depth_sq < 0: return True
-        elif text[i] == '}': depth_br += 1
-        elif text[i] == '{':
-            depth_br -= 1
-            if depth_br < 0: return True
-    return False
-
-def _find_break_point(line):
-    end = len(line) - 2
-    if end < 0:
-        return -1
-    start = max(0, end - 25)
-    for j in range(end, start, -1):
-        ch = line[j]
-        if (ch in _WRAP_BREAK_AFTER or ch == ' ') and not _is_inside_tag(line, j):
-            return j + 1
-    for j in range(end, start, -1):
-        if ord(line[j]) > 0x2E80 and line[j] not in _WRAP_NO_LINE_START and not _is_inside_tag(line, j):
+    """计算文本显示宽度（1/16 em，忽略格式标签）"""
+    clean = _DW_SQ_TAG_RE.sub('', text)
+    clean = _DW_BRACE_TAG_RE.sub(_WIDTH_PLACEHOLDER, clean)
+    return sum(map(_CHAR_WIDTHS.__getitem__, clean))
+
+
+class _WrapTokens:
+    """单行文本的一次性预处理结果，供 _wrap_single_line 单遍断行使用
+
+    - 标签区间（tag_starts/tag_ends）与文本区间交替，标签字符不计宽度
+    - pw：逐字符宽度的前缀和（[img:...] 结尾处按一个全角字符计）
+    - 括号位置及其后的 []/{} 深度，用于O(log n)判断断点是否在标签内
+    """
+    __slots__ = ('text', 'tag_starts', 'tag_ends', 'pw', 'img_pos', 'img_src',
+                 'bpos', 'sq_after', 'br_after')
+
+    def __init__(self, text):
+        self.text = text
+        widths = list(map(_CHAR_WIDTHS.__getitem__, text))
+        spans = [m.span() for m in _WRAP_TAG_RE.finditer(text)]
+        self.tag_starts = [a for a, _ in spans]
+        self.tag_ends = [b for _, b in spans]
+        for a, b in spans:
+            widths[a:b] = [0] * (b - a)
+        self.img_pos = []
+        self.img_src = []
+        if '[img:' in text:
+            for a, b in spans:
+                e = b - 1
+                if e > a and text[a] == '[' and text[e] == ']':
+                    # 行尾匹配 \[img:[^\]]*\]$ ：上一个']'之后出现过'[img:'
+                    p = text.rfind('[img:', text.rfind(']', 0, e) + 1, e)
+                    if p >= 0:
+                        widths[e] = _WIDTH_FULL
+                        self.img_pos.append(e)
+                        self.img_src.append(p)
+        self.pw = [0]
+        self.pw.extend(accumulate(widths))
+        self.bpos = [m.start() for m in _WRAP_BRACKET_RE.finditer(text)]
+        brackets = _WRAP_BRACKET_RE.findall(text)
+        self.sq_after = list(accumulate(map(_WRAP_SQ_DELTA.__getitem__, brackets)))
+        self.br_after = list(accumulate(map(_WRAP_BR_DELTA.__getitem__, brackets)))
+
+    def next_text_pos(self, j):
+        """j或其后第一个不属于标签的位置"""
+        starts, ends = self.tag_starts, self.tag_ends
+        t = bisect_right(starts, j) - 1
+        while t >= 0 and t < len(starts) and starts[t] <= j < ends[t]:
+            j = ends[t]
+            t += 1
+        return j
+
+    def depth_at(self, m):
+        """位置m之前（不含m）的 []、{} 深度"""
+        t = bisect_left(self.bpos, m) - 1
+        if t < 0:
+            return 0, 0
+        return self.sq_after[t], self.br_after[t]
+
+
+class _WrapLine:
+    """当前行的标签内判断：从行首到位置c出现过未闭合的'['或'{'即视为在标签内"""
+    __slots__ = ('tok', 'ls', 't0', 'min_sq', 'min_br')
+
+    def __init__(self, tok, ls):
+        self.tok = tok
+        self.ls = ls
+        self.t0 = bisect_left(tok.bpos, ls)
+        base_sq, base_br = tok.depth_at(ls)
+        self.min_sq = [base_sq]  # min_sq[i]：行首到第t0+i-1个括号之后的最小深度
+        self.min_br = [base_br]
+
+    def inside(self, c):
+        tok = self.tok
+        bpos = tok.bpos
+        cnt = bisect_left(bpos, c, self.t0) - self.t0
+        if cnt == 0 and (self.t0 >= len(bpos) or bpos[self.t0] != c):
+            return False  # 行首到c之间没有括号
+        min_sq, min_br = self.min_sq, self.min_br
+        have = len(min_sq)
+        if have <= cnt:
+            t = self.t0 + have - 1
+            t_end = self.t0 + cnt
+            min_sq.extend(accumulate(tok.sq_after[t:t_end], min, initial=min_sq[-1]))
+            min_br.extend(accumulate(tok.br_after[t:t_end], min, initial=min_br[-1]))
+            del min_sq[have], min_br[have]  # 去掉重复的initial
+        sq, br = tok.depth_at(c + 1)
+        return sq > min_sq[cnt] or br > min_br[cnt]
+
+
+def _find_break_point(tok, line, k):
+    """在 (k-1-窗口, k-1] 内找最后一个不在标签内的断点：优先标点/空格，其次中日韩字符"""
+    text = tok.text
+    lower = max(line.ls, k - 1 - _WRAP_WINDOW)
+    for m in reversed(list(_WRAP_BREAK1_RE.finditer(text, lower + 1, k))):
+        if not line.inside(m.start()):
+            return m.start() + 1
+    for j in range(k - 1, lower, -1):
+        ch = text[j]
+        if ord(ch) > 0x2E80 and ch not in _WRAP_NO_LINE_START and not line.inside(j):
             return j + 1
     return -1
 
+
 def _wrap_single_line(text, max_width=None):
+    """给单行长文本插入换行
+
+    预处理一次（标签区间、宽度前缀和、括号深度），然后单遍向前：
+    用二分直接跳到下一个宽度超限的字符，只在那里查找断点，整体线性时间。
+    """
     if max_width is None:
         max_width = _WRAP_MAX_WIDTH
+    max_width *= _WIDTH_HALF
     if _display_width(text) <= max_width:
         return text
+    tok = _WrapTokens(text)
+    pw, bpos, img_pos, img_src = tok.pw, tok.bpos, tok.img_pos, tok.img_src
+    n = len(text)
     result = []
-    line = ''
+    line = _WrapLine(tok, 0)
     width = 0
-    in_tag = False
-    tag_end_char = ''
-    for i, c in enumerate(text):
-        if not in_tag and c in '[{':
-            in_tag = True
-            tag_end_char = ']' if c == '[' else '}'
-        is_end = in_tag and c == tag_end_char
-        if is_end:
-            in_tag = False
-        if in_tag or c in '[]{}': 
-            line += c
-            if is_end and re.search(r'\[img:[^\]]*\]$', line):
-                width += 2
+    i = 0  # 下一个待处理位置
+    while i < n:
+        # 第一个累计宽度达到上限的位置j，再取其后第一个普通字符k（只在普通字符处检查）
+        j = bisect_left(pw, max_width - width + pw[i], i + 1) - 1
+        if j >= n:
+            break
+        k = tok.next_text_pos(j)
+        if k >= n:
+            break
+        # 起点在行首之前的[img:]不计宽度（罕见情况，逐个修正）
+        adjust = 0
+        skip_to = -1
+        for t in range(bisect_left(img_pos, i), bisect_right(img_pos, k)):
+            if img_src[t] < line.ls:
+                if img_pos[t] <= j:
+                    skip_to = img_pos[t]
+                    break
+                adjust += _WIDTH_FULL
+        if skip_to >= 0:
+            width += pw[skip_to + 1] - pw[i] - _WIDTH_FULL
+            i = skip_to + 1
+            continue
+        width += pw[k + 1] - pw[i] - adjust
+        i = k + 1
+        bp = _find_break_point(tok, line, k)
+        if bp <= 0:
             continue
-        width += 2 if ord(c) > 0x2E80 else 1
-        line += c
-        if width >= max_width and not in_tag:
-            bp = _find_break_point(line)
-            if bp > 0:
-                while bp < len(line) and line[bp] in _WRAP_NO_LINE_START:
-                    bp += 1
-                if bp < len(line):
-                    result.append(line[:bp])
-                    line = line[bp:]
-                    width = _display_width(line)
-    if line:
-        result.append(line)
+        while bp <= k and text[bp] in _WRAP_NO_LINE_START:
+            bp += 1
+        if bp <= k:
+            result.append(text[line.ls:bp])
+            line = _WrapLine(tok, bp)
+            if line.t0 < len(bpos) and bpos[line.t0] <= k:
+                width = _display_width(text[bp:k + 1])
+            else:
+                width = pw[k + 1] - pw[bp]  # 没有标签，直接用前缀和
+    if line.ls < n:
+        result.append(text[line.ls:])
     return '\n'.join(result)
 
+
 def clean_control_chars(text):
     text = text.replace('\r\n', '\n').replace('\r', '\n')
     return re.sub(r'[\x00-\x09\x0b\x0c\x0e-\x1f]', '', text)
@@ -349,66 +795,699 @@ def auto_wrap_text(text, wrap_width=None):
     return '\n'.join(_wrap_single_line(line, wrap_width) for line in text.split('\n'))
 
 
+class WrapCache:
+    """自动换行结果的LRU缓存，键为 (文本哈希, 换行宽度或流水线签名)
+
+    保存/打补丁时大部分译文和换行宽度都不变，只有改动过的文本需要重新换行。
+    线程安全（补丁在后台线程执行，保存在主线程执行）。
+    """
+
+    def __init__(self, max_entries=200000, record_misses=False):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # 记录新换行的 [(键, 结果)]，供子进程把结果带回主进程的缓存
+        self.new_entries = [] if record_misses else None
+
+    def wrap(self, text, wrap_width):
+        """换行单条文本（优先取缓存）"""
+        return self.wrap_many([text], wrap_width)[text]
+
+    def wrap_many(self, texts, wrap_width):
+        """批量换行，返回 {原文: 换行结果}；相同原文只处理一次"""
+        return self.map_many(texts, wrap_width,
+                             lambda missing: [auto_wrap_text(text, wrap_width) for text in missing])
+
+    def map_many(self, texts, tag, fn):
+        """通用批量缓存：键为 (文本哈希, tag)，未命中的文本列表交给 fn 一次处理
+        fn(texts) 返回同样顺序的结果列表；返回 {原文: 结果}
+        """
+        result = {}
+        missing = []
+        with self._lock:
+            for text in texts:
+                if text in result:
+                    continue
+                key = (source_hash(text), tag)
+                value = self._data.get(key)
+                if value is None:
+                    result[text] = None
+                    missing.append((key, text))
+                else:
+                    self._data.move_to_end(key)
+                    result[text] = value
+                    self.hits += 1
+        if not missing:
+            return result
+        # 处理在锁外进行
+        values = fn([text for _, text in missing])
+        done = [(key, text, value) for (key, text), value in zip(missing, values)]
+        with self._lock:
+            for key, text, value in done:
+                self._data[key] = value
+                self._data.move_to_end(key)
+                result[text] = value
+            self.misses += len(done)
+            if self.new_entries is not None:
+                self.new_entries.extend((key, value) for key, _, value in done)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+        return result
+
+    def lookup(self, texts, tag):
+        """返回已缓存的 {键: 结果}（不计入命中统计）"""
+        found = {}
+        with self._lock:
+            for text in texts:
+                key = (source_hash(text), tag)
+                wrapped = self._data.get(key)
+                if wrapped is not None:
+                    self._data.move_to_end(key)
+                    found[key] = wrapped
+        return found
+
+    def put(self, entries, hits=0, misses=0):
+        """写入 [(键, 换行结果)]，并累加其他进程的命中统计"""
+        with self._lock:
+            for key, wrapped in entries:
+                self._data[key] = wrapped
+                self._data.move_to_end(key)
+            self.hits += hits
+            self.misses += misses
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def take_stats(self):
+        """返回并清零 (命中数, 重新换行数)"""
+        with self._lock:
+            stats = (self.hits, self.misses)
+            self.hits = self.misses = 0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+
+WRAP_CACHE = WrapCache()
+
+
+CHAR_WIDTHS_CACHE_NAME = '.char_widths.bin'
+_CHAR_WIDTHS_MAGIC = b'CWT1'
+
+
+def build_char_widths(advances, units_per_em):
+    """把 {码点: advance width} 换算成 1/16 em 的BMP宽度表"""
+    table = bytearray(0x10000)
+    for cp, aw in advances.items():
+        if 0 <= cp < 0x10000 and aw > 0:
+            table[cp] = min(255, max(1, round(aw * _WIDTH_FULL / units_per_em)))
+    return table
+
+
+def load_char_widths(font_path='', swf_path='', gpak_path='', cache_dir=None):
+    """按字体度量构建宽度表，返回 CharWidthTable；没有可用字体时返回 None
+
+    来源优先级与打补丁一致：预转换SWF > TTF/OTF字体 > 游戏自带unicodefont.swf。
+    结果以 (来源路径, mtime, 大小) 为指纹缓存到 cache_dir 下，字体不变时不再重新解析。
+    """
+    if swf_path and os.path.isfile(swf_path):
+        kind, path = 'swf', swf_path
+    elif font_path and os.path.isfile(font_path):
+        kind, path = 'font', font_path
+    elif gpak_path and os.path.isfile(gpak_path):
+        kind, path = 'gpak', gpak_path
+    else:
+        return None
+    st = os.stat(path)
+    fingerprint = source_hash(f"{kind}|{os.path.abspath(path)}|{st.st_mtime_ns}|{st.st_size}").encode('ascii')
+    source = f"{os.path.basename(path)}" if kind != 'gpak' else 'unicodefont.swf'
+    cache_path = os.path.join(cache_dir, CHAR_WIDTHS_CACHE_NAME) if cache_dir else None
+    if cache_path and os.path.isfile(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            header = _CHAR_WIDTHS_MAGIC + fingerprint
+            if data.startswith(header) and len(data) == len(header) + 0x10000:
+                return CharWidthTable(bytearray(data[len(header):]), source)
+        except OSError:
+            pass
+
+    from font_to_swf import read_font_advances, read_swf_advances
+    if kind == 'font':
+        advances, units_per_em = read_font_advances(path)
+    else:
+        if kind == 'swf':
+            with open(path, 'rb') as f:
+                swf = f.read()
+        else:
+            with open(path, 'rb') as fs:
+                entries, data_start = read_gpak_index(fs)
+            swf = extract_file_from_gpak(path, entries, data_start, 'swfs/unicodefont.swf')
+            if not swf:
+                return None
+        advances, units_per_em = read_swf_advances(swf)
+    if not advances:
+        return None
+    table = build_char_widths(advances, units_per_em)
+    if cache_path:
+        try:
+            tmp = cache_path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(_CHAR_WIDTHS_MAGIC + fingerprint + bytes(table))
+            os.replace(tmp, cache_path)
+        except OSError:
+            pass
+    return CharWidthTable(table, source)
+
+
+def set_char_widths(table):
+    """切换换行使用的宽度表（None 表示按码点估算），宽度表变化时清空换行缓存"""
+    global _CHAR_WIDTHS
+    if table is None:
+        table = CharWidthTable()
+    old = _CHAR_WIDTHS
+    if old.advances == table.advances:
+        return
+    _CHAR_WIDTHS = table
+    WRAP_CACHE.clear()
+
+
+# ==================== 换行检查 ====================
+
+LINT_KINDS = {'overflow': '超出宽度', 'unbreakable': '无法断行', 'tag': '标签异常'}
+LINT_REPORT_NAME = 'wrap_lint_report.txt'
+# 多进程检查的分界点（总字符数）与每个任务的行数
+_LINT_PARALLEL_MIN_CHARS = 2 * 1024 * 1024
+_LINT_CHUNK_ROWS = 2000
+_TAG_PAIRS = {']': '[', '}': '{'}
+
+
+def _find_tag_problem(text):
+    """检查 [] {} 是否成对，返回问题描述；正常时返回空字符串"""
+    opened = ''
+    for m in _WRAP_BRACKET_RE.finditer(text):
+        c = m.group()
+        if c in '[{':
+            if opened:
+                return f"标签 {opened} 未闭合就出现了 {c}（位置{m.start()}）"
+            opened = c
+        elif _TAG_PAIRS[c] == opened:
+            opened = ''
+        else:
+            return f"多余的 {c}（位置{m.start()}）"
+    if opened:
+        return f"标签 {opened} 未闭合"
+    return ''
+
+
+def _has_break_chance(line):
+    """行内（标签外、行尾之前）是否存在可断行的位置"""
+    clean = _DW_BRACE_TAG_RE.sub('', _DW_SQ_TAG_RE.sub('', line))[:-1]
+    return any(ch == ' ' or ch in _WRAP_BREAK_AFTER or ord(ch) > 0x2E80 for ch in clean)
+
+
+def lint_text(text, wrap_width, normalize_punct=False):
+    """按打补丁时的方式换行，返回问题列表 [(类型, 行号, 说明)]"""
+    text = text.replace('\n', '').replace('\r', '')
+    if normalize_punct:
+        text = PunctuationStage().apply(None, text)
+    problems = []
+    tag_problem = _find_tag_problem(text)
+    if tag_problem:
+        problems.append(('tag', 0, tag_problem))
+    if wrap_width is None:
+        return problems
+    limit = wrap_width * _WIDTH_HALF
+    for no, line in enumerate(auto_wrap_text(text, wrap_width).split('\n'), 1):
+        if not tag_problem:
+            split_problem = _find_tag_problem(line)
+            if split_problem:
+                problems.append(('tag', no, f"换行拆开了标签: {split_problem}"))
+        width = _display_width(line)
+        if width > limit:
+            kind = 'overflow' if _has_break_chance(line) else 'unbreakable'
+            problems.append((kind, no, f"宽度 {width / _WIDTH_HALF:g}/{wrap_width}: {line[:40]}"))
+    return problems
+
+
+def _lint_chunk(items, wrap_width, advances, normalize_punct=False):
+    """检查一批 (文件, key, 文本)，进程池任务入口"""
+    if advances is not _CHAR_WIDTHS.advances:
+        set_char_widths(CharWidthTable(advances))
+    issues = []
+    for fname, key, text in items:
+        for kind, no, detail in lint_text(text, wrap_width, normalize_punct):
+            issues.append((fname, key, kind, no, detail))
+    return issues
+
+
+def lint_translations(items, wrap_width, workers=None, normalize_punct=False):
+    """批量检查 [(文件, key, 文本)]，文本总量足够大时使用进程池并行
+    返回 [(文件, key, 类型, 行号, 说明)]，顺序与输入一致
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    advances = _CHAR_WIDTHS.advances
+    chunks = [items[i:i + _LINT_CHUNK_ROWS] for i in range(0, len(items), _LINT_CHUNK_ROWS)]
+    total_chars = sum(len(text) for _, _, text in items)
+    results = None
+    if workers > 1 and len(chunks) > 1 and total_chars >= _LINT_PARALLEL_MIN_CHARS:
+        from concurrent.futures import ProcessPoolExecutor
+        try:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+                results = list(pool.map(_lint_chunk, chunks, [wrap_width] * len(chunks),
+                                        [advances] * len(chunks), [normalize_punct] * len(chunks)))
+        except Exception:
+            results = None  # 进程池不可用时回退单进程
+    if results is None:
+        results = [_lint_chunk(chunk, wrap_width, advances, normalize_punct) for chunk in chunks]
+    return [issue for chunk_issues in results for issue in chunk_issues]
+
+
+class WrapLinter:
+    """增量换行检查：记住每行译文的哈希与结果，只重新检查改动过的行
+
+    换行宽度或字符宽度表变化时全部重新检查。
+    """
+
+    def __init__(self):
+        self._results = {}  # (文件, key) → (译文哈希, [(类型, 行号, 说明)])
+        self._config = None
+
+    def check(self, translations, wrap_width, workers=None, normalize_punct=False):
+        """检查 {文件: {key: 译文}}，返回 (问题列表, 本次实际检查的行数)"""
+        config = (wrap_width, normalize_punct, _CHAR_WIDTHS)
+        if self._config is None or self._config[:2] != config[:2] or self._config[2] is not _CHAR_WIDTHS:
+            self._results.clear()
+            self._config = config
+        pending = []
+        hashes = {}
+        for fname, trans in translations.items():
+            for key, text in trans.items():
+                if not isinstance(text, str) or not text:
+                    continue
+                h = source_hash(text)
+                hashes[(fname, key)] = h
+                cached = self._results.get((fname, key))
+                if cached is None or cached[0] != h:
+                    pending.append((fname, key, text))
+        for row in list(self._results):
+            if row not in hashes:
+                del self._results[row]
+        found = {}
+        for fname, key, kind, no, detail in lint_translations(pending, wrap_width, workers, normalize_punct):
+            found.setdefault((fname, key), []).append((kind, no, detail))
+        for fname, key, _ in pending:
+            self._results[(fname, key)] = (hashes[(fname, key)], found.get((fname, key), []))
+        issues = []
+        for (fname, key), (_, problems) in sorted(self._results.items()):
+            for kind, no, detail in problems:
+                issues.append((fname, key, kind, no, detail))
+        return issues, len(pending)
+
+
+# ==================== 行处理流水线 ====================
+
+class RowStage:
+    """写入CSV前对每行译文做的一步处理
+
+    apply(key, text) 返回处理后的文本。cacheable 表示结果只取决于文本本身，
+    可以按文本哈希缓存；signature() 返回影响结果的参数（用作缓存键）。
+    """
+    name = ''
+    cacheable = True
+
+    def signature(self):
+        return (type(self).__name__,)
+
+    def apply(self, key, text):
+        return text
+
+
+class ProtectedKeyStage(RowStage):
+    """受保护的key（语言配置等）始终写入固定值"""
+    name = '受保护key'
+    cacheable = False
+
+    def apply(self, key, text):
+        return PROTECTED_KEYS.get(key, text)
+
+
+class StripNewlineStage(RowStage):
+    """去除译文中残留的换行（打补丁时按当前设置重新换行）"""
+    name = '去除换行'
+
+    def apply(self, key, text):
+        return text.replace('\n', '').replace('\r', '')
+
+
+class CleanControlStage(RowStage):
+    """统一换行符并去除控制字符"""
+    name = '清理控制字符'
+
+    def apply(self, key, text):
+        return clean_control_chars(text)
+
+
+_PUNCT_TAG_RE = re.compile(r'(\[[^\]]*\]|\{[^}]*\})')
+_PUNCT_AFTER_CJK_RE = re.compile(r'(?<=[\u2e81-\uffff])[,!?;:]')
+_PUNCT_FULLWIDTH = {',': '，', '!': '！', '?': '？', ';': '；', ':': '：'}
+
+
+class PunctuationStage(RowStage):
+    """中文后面的半角 , ! ? ; : 换成全角（不改动标签内的内容）"""
+    name = '标点规范化'
+
+    def apply(self, key, text):
+        parts = _PUNCT_TAG_RE.split(text)
+        for i in range(0, len(parts), 2):
+            parts[i] = _PUNCT_AFTER_CJK_RE.sub(lambda m: _PUNCT_FULLWIDTH[m.group()], parts[i])
+        return ''.join(parts)
+
+
+class WrapStage(RowStage):
+    """按显示宽度自动换行（wrap_width=None 不换行）"""
+    name = '自动换行'
+
+    def __init__(self, wrap_width):
+        self.wrap_width = wrap_width
+
+    def signature(self):
+        return ('wrap', self.wrap_width)
+
+    def apply(self, key, text):
+        if self.wrap_width is None:
+            return text
+        return '\n'.join(_wrap_single_line(line, self.wrap_width) for line in text.split('\n'))
+
+
+class TraditionalStage(RowStage):
+    """简体→繁体逐字查表转换（表见 load_s2t_table）"""
+    name = '简转繁'
+
+    def __init__(self, table):
+        self.table = table
+        self.digest = source_hash(''.join(f"{k:x}{v}" for k, v in sorted(table.items())))
+
+    def signature(self):
+        return ('s2t', self.digest)
+
+    def apply(self, key, text):
+        return text.translate(self.table)
+
+
+S2T_TABLE_NAME = 'STCharacters.txt'
+
+
+def load_s2t_table(path):
+    """读取OpenCC格式的简繁字表（每行 "简<TAB>繁 [其他候选]"），取第一个候选
+    返回可直接用于 str.translate 的 {码点: 繁体字}
+    """
+    table = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            parts = line.rstrip('\r\n').split('\t')
+            if len(parts) < 2 or len(parts[0]) != 1:
+                continue
+            candidates = parts[1].split()
+            if candidates and candidates[0] != parts[0]:
+                table[ord(parts[0])] = candidates[0]
+    return table
+
+
+class RowPipeline:
+    """按顺序组合的行处理阶段，逐文件批量处理并分别计时
+
+    最后一个不可缓存阶段之后的部分作为整体按 (输入文本哈希, 各阶段签名) 缓存，
+    命中时整段跳过。
+    """
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self.timings = {}  # 阶段名 → 累计秒数
+        split = 0
+        for i, stage in enumerate(self.stages):
+            if not stage.cacheable:
+                split = i + 1
+        self._split = split
+        self.cache_tag = tuple(stage.signature() for stage in self.stages[split:])
+
+    def _run_stages(self, stages, keys, texts):
+        for stage in stages:
+            t0 = time.perf_counter()
+            texts = [stage.apply(k, t) for k, t in zip(keys, texts)]
+            self.timings[stage.name] = self.timings.get(stage.name, 0.0) + time.perf_counter() - t0
+        return texts
+
+    def cache_inputs(self, items):
+        """运行不可缓存的前半段，返回进入缓存段的文本列表"""
+        return self._run_stages(self.stages[:self._split], [k for k, _ in items], [t for _, t in items])
+
+    def run_many(self, items, cache=None):
+        """处理 [(key, 译文)]，返回处理后的译文列表（顺序不变）"""
+        texts = self.cache_inputs(items)
+        tail = self.stages[self._split:]
+        if cache is None or not tail:
+            return self._run_stages(tail, [k for k, _ in items], texts)
+        done = cache.map_many(texts, self.cache_tag,
+                              lambda missing: self._run_stages(tail, [None] * len(missing), missing))
+        return [done[t] for t in texts]
+
+    def merge_timings(self, timings):
+        for name, seconds in timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def format_timings(self):
+        return '，'.join(f"{stage.name} {self.timings.get(stage.name, 0.0) * 1000:.0f}ms"
+                        for stage in self.stages)
+
+
+def patch_pipeline(wrap_width, strip_newlines=False, normalize_punct=False, s2t_table=None):
+    """打补丁/保存CSV使用的默认流水线（s2t_table 非空时输出繁体）"""
+    stages = [ProtectedKeyStage()]
+    if strip_newlines:
+        stages.append(StripNewlineStage())
+    stages.append(CleanControlStage())
+    if normalize_punct:
+        stages.append(PunctuationStage())
+    if s2t_table:
+        stages.append(TraditionalStage(s2t_table))
+    stages.append(WrapStage(wrap_width))
+    return RowPipeline(stages)
+
+
 # ==================== 补丁相关 ====================
 
-def patch_csv_bytes(raw_bytes, translations, target_lang=CN_TARGET_LANG, wrap_width=None):
-    """将中文翻译写入CSV的指定语言列"""
+def patch_csv_bytes(raw_bytes, translations, target_lang=CN_TARGET_LANG, wrap_width=None, wrap_cache=None,
+                    pipeline=None):
+    """将中文翻译写入CSV的指定语言列
+
+    pipeline: RowPipeline，整个文件有译文的行批量经过流水线处理；
+              不传时为 清理控制字符→自动换行(wrap_width)
+    wrap_cache: WrapCache，传入时复用流水线可缓存部分的结果
+    """
+    if pipeline is None:
+        pipeline = RowPipeline([CleanControlStage(), WrapStage(wrap_width)])
+    patched, counts = patch_csv_columns(raw_bytes, [(target_lang, translations, pipeline)], wrap_cache)
+    return patched, counts[0]
+
+
+def patch_csv_columns(raw_bytes, targets, wrap_cache=None):
+    """一次切分CSV，同时写入多个语言列
+
+    targets: [(列名, {key: 译文}, RowPipeline)]；列不存在时追加到末尾，
+    没有译文的行用英文填充。译文与流水线都相同的列只处理一次。
+    返回 (新内容, [各列翻译条数])
+    """
+    outputs, counts = patch_csv_views(raw_bytes, targets, [range(len(targets))], wrap_cache)
+    return outputs[0], counts
+
+
+def patch_csv_views(raw_bytes, targets, views, wrap_cache=None):
+    """一次切分CSV、一次处理译文，按 views 同时生成多份内容
+
+    views: [[targets 下标]]，每份内容只写入列出的列（如工作CSV只写schinese，补丁包写全部列）
+    返回 ([各份新内容], [各列翻译条数])
+    """
     bom = b''
     data = raw_bytes
     if data.startswith(b'\xef\xbb\xbf'):
         bom = b'\xef\xbb\xbf'
         data = data[3:]
     text = data.decode('utf-8')
-    line_ending = '\r\n' if '\r\n' in text else '\n'
     rows = split_csv_logical_rows(text)
     if not rows:
-        return raw_bytes, 0
+        return [raw_bytes] * len(views), [0] * len(targets)
 
     header = rows[0]
     header_stripped = header.rstrip('\r\n')
     header_fields = split_csv_fields(header_stripped)
     en_col_idx = 1
-    target_col_idx = -1
+    col_idx = [-1] * len(targets)
     for idx, f in enumerate(header_fields):
         name = f.strip().lower()
         if name == 'en':
             en_col_idx = idx
-        if name == target_lang:
-            target_col_idx = idx
-
-    if target_col_idx < 0:
-        header_stripped_noeol = header.rstrip('\r\n')
-        header_ending = header[len(header_stripped_noeol):]
-        header = header_stripped_noeol + ',' + target_lang + header_ending
-    output_parts = [header]
-    translated_count = 0
+        for t, (lang, _, _) in enumerate(targets):
+            if name == lang:
+                col_idx[t] = idx
+    header_ending = header[len(header_stripped):]
+    # 每份内容：(已有列 [(下标, 列号)], 追加列 [下标], 输出片段)
+    layouts = []
+    for view in views:
+        present = [(t, col_idx[t]) for t in view if col_idx[t] >= 0]
+        appended = [t for t in view if col_idx[t] < 0]
+        view_header = header
+        if appended:
+            view_header = header_stripped + ''.join(',' + targets[t][0] for t in appended) + header_ending
+        layouts.append((present, appended, [view_header]))
+
+    # 各列有译文的行批量经过流水线
+    data_rows = []
     for row in rows[1:]:
         row_stripped = row.rstrip('\r\n')
-        row_ending = row[len(row_stripped):]
         trimmed = row_stripped.strip()
         if not trimmed or trimmed.startswith('//'):
-            output_parts.append(row)
-            continue
-        key = get_first_field(row_stripped)
-        if key and key in translations:
-            cn_text = auto_wrap_text(translations[key], wrap_width)
-            translated_count += 1
+            data_rows.append((row, None, None))
         else:
-            # 无翻译时用英文填充
-            fields = split_csv_fields(row_stripped)
-            cn_text = unquote_csv_field(fields[en_col_idx]) if en_col_idx < len(fields) else ''
-        cn_field = csv_escape_field(cn_text)
-        if target_col_idx >= 0:
-            fields = split_csv_fields(row_stripped)
-            while len(fields) <= target_col_idx:
-                fields.append('')
-            fields[target_col_idx] = cn_field
-            output_parts.append(','.join(fields) + row_ending)
-        else:
-            output_parts.append(row_stripped + ',' + cn_field + row_ending)
+            data_rows.append((row, row_stripped, get_first_field(row_stripped)))
+    processed = []
+    done = {}
+    for lang, translations, pipeline in targets:
+        ident = (id(translations), id(pipeline))
+        if ident not in done:
+            items = [(key, translations[key]) for _, _, key in data_rows if key and key in translations]
+            done[ident] = dict(zip([k for k, _ in items], pipeline.run_many(items, wrap_cache)))
+        processed.append(done[ident])
+
+    counts = [0] * len(targets)
+    for row, row_stripped, key in data_rows:
+        if row_stripped is None:
+            for _, _, parts in layouts:
+                parts.append(row)
+            continue
+        row_ending = row[len(row_stripped):]
+        fields = None
+        cells = []
+        for t, (_, translations, _) in enumerate(targets):
+            if key and key in translations:
+                cn_text = processed[t][key]
+                counts[t] += 1
+            else:
+                # 无翻译时用英文填充
+                if fields is None:
+                    fields = split_csv_fields(row_stripped)
+                cn_text = unquote_csv_field(fields[en_col_idx]) if en_col_idx < len(fields) else ''
+            cells.append(csv_escape_field(cn_text))
+        for present, appended, parts in layouts:
+            if present:
+                if fields is None:
+                    fields = split_csv_fields(row_stripped)
+                row_fields = list(fields)
+                for t, idx in present:
+                    while len(row_fields) <= idx:
+                        row_fields.append('')
+                    row_fields[idx] = cells[t]
+                line = ','.join(row_fields)
+            else:
+                line = row_stripped
+            for t in appended:
+                line += ',' + cells[t]
+            parts.append(line + row_ending)
+
+    return [bom + ''.join(parts).encode('utf-8') for _, _, parts in layouts], counts
+
+
+# 多进程打补丁的分界点：译文总字符数小于此值时保持单进程
+_PARALLEL_PATCH_MIN_CHARS = 1024 * 1024
+
+
+def _unique_pipelines(targets):
+    """[(列名, RowPipeline)] 中不重复的流水线（保持顺序）"""
+    seen = {}
+    for _, pipeline in targets:
+        seen.setdefault(id(pipeline), pipeline)
+    return list(seen.values())
+
 
-    result_text = ''.join(output_parts)
-    return bom + result_text.encode('utf-8'), translated_count
+def _patch_csv_file(csv_path, trans, targets, wrap_cache):
+    """读取单个CSV，一次切分生成只含第一列(schinese)的工作CSV和含全部目标列的打包内容，
+    返回 (打包用内容, 第一列翻译条数, 耗时秒)
+
+    额外输出列（覆盖语言、繁体）只进补丁包，不写回用户的工作CSV。
+    """
+    t0 = time.perf_counter()
+    with open(csv_path, 'rb') as f:
+        raw_bytes = f.read()
+    # 工作CSV只写第一列，补丁包写全部列：同一次切分同时生成两份
+    views = [[0]]
+    if len(targets) > 1:
+        views.append(range(len(targets)))
+    outputs, counts = patch_csv_views(
+        raw_bytes, [(lang, trans, pipeline) for lang, pipeline in targets], views, wrap_cache)
+    saved_bytes, patched_bytes = outputs[0], outputs[-1]
+    with open(csv_path, 'wb') as f:
+        f.write(saved_bytes)
+    return patched_bytes, counts[0], time.perf_counter() - t0
+
+
+def _patch_csv_job(csv_path, trans, targets, advances, known):
+    """进程池任务：known 为主进程缓存中已有的结果，新处理的结果和各阶段耗时随返回值带回"""
+    if advances is not _CHAR_WIDTHS.advances:
+        set_char_widths(CharWidthTable(advances))
+    pipelines = _unique_pipelines(targets)
+    for pipeline in pipelines:
+        pipeline.timings = {}
+    cache = WrapCache(record_misses=True)
+    cache.put(known.items())
+    patched_bytes, cnt, elapsed = _patch_csv_file(csv_path, trans, targets, cache)
+    return patched_bytes, cnt, elapsed, cache.new_entries, cache.hits, [p.timings for p in pipelines]
+
+
+def patch_csv_files(jobs, targets, wrap_cache=None, workers=None):
+    """批量打补丁 [(csv_path, translations)]，每个文件一次写入所有目标列 [(列名, RowPipeline)]
+    译文量足够大时使用进程池并行。返回 [(新内容, 第一列翻译条数, 耗时秒)]，顺序与输入一致；
+    各阶段耗时累计到对应流水线的 timings
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pipelines = _unique_pipelines(targets)
+    total_chars = sum(len(v) for _, trans in jobs for v in trans.values() if isinstance(v, str))
+    if workers > 1 and len(jobs) > 1 and total_chars >= _PARALLEL_PATCH_MIN_CHARS:
+        from concurrent.futures import ProcessPoolExecutor
+        known = []
+        for _, trans in jobs:
+            found = {}
+            if wrap_cache is not None:
+                items = list(trans.items())
+                for pipeline in pipelines:
+                    found.update(wrap_cache.lookup(pipeline.cache_inputs(items), pipeline.cache_tag))
+            known.append(found)
+        advances = _CHAR_WIDTHS.advances
+        # 大文件先提交，结果再按输入顺序排列
+        order = sorted(range(len(jobs)), key=lambda i: len(jobs[i][1]), reverse=True)
+        try:
+            results = [None] * len(jobs)
+            with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+                futures = {i: pool.submit(_patch_csv_job, jobs[i][0], jobs[i][1], targets,
+                                          advances, known[i]) for i in order}
+                for i in range(len(jobs)):
+                    patched_bytes, cnt, elapsed, new_entries, hits, timings = futures[i].result()
+                    if wrap_cache is not None:
+                        wrap_cache.put(new_entries, hits, len(new_entries))
+                    for pipeline, stage_timings in zip(pipelines, timings):
+                        pipeline.merge_timings(stage_timings)
+                    results[i] = (patched_bytes, cnt, elapsed)
+            return results
+        except Exception:
+            pass  # 进程池不可用时回退单进程（已写回的文件内容相同，可重复写入）
+    return [_patch_csv_file(csv_path, trans, targets, wrap_cache) for csv_path, trans in jobs]
 
 
 def write_gpak(output_path, entries, data_start, original_gpak, patch_files, progress_cb=None):
@@ -517,6 +1596,1109 @@ def update_settings(game_dir, lang):
     return 'not_found', found_files
 
 
+# ==================== 翻译日志（追加写入） ====================
+
+JOURNAL_NAME = 'translations.journal.jsonl'
+EXPORT_MANIFEST_NAME = '.csv_export_manifest.json'
+
+
+def _write_json_atomic(path, data):
+    """安全写入JSON文件"""
+    tmp = path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def source_hash(text):
+    """计算英文原文的短哈希（用于识别原文已变化的过期翻译）"""
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def read_journal(path):
+    """逐条读取翻译日志，返回记录列表（跳过崩溃时写了一半的行）"""
+    records = []
+    if not os.path.isfile(path):
+        return records
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(rec, dict) and rec.get('file') and rec.get('key') and isinstance(rec.get('text'), str):
+                records.append(rec)
+    return records
+
+
+class TranslationJournal:
+    """追加式翻译日志：每条AI结果追加一行JSON，批量fsync，按需合并回CSV
+
+    持久化开销只与新结果数量相关；合并时先把当前日志轮换为 .compacting 段，
+    合并成功后再删除，崩溃后启动时两段都会重放。
+    """
+
+    def __init__(self, path, sync_every=200, sync_interval=1.0):
+        self.path = path
+        self.compacting_path = path + '.compacting'
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self._lock = threading.Lock()
+        self._fh = None
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def append(self, csv_name, key, text, src_hash=''):
+        """追加一条已接受的翻译"""
+        rec = {'file': csv_name, 'key': key, 'text': text, 'src': src_hash, 'ts': round(time.time(), 3)}
+        line = json.dumps(rec, ensure_ascii=False) + '\n'
+        with self._lock:
+            if self._fh is None:
+                self._fh = open(self.path, 'a', encoding='utf-8')
+                # 崩溃时可能留下半行，先补换行避免与新记录粘连
+                if self._fh.tell() > 0:
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            self._fh.write('\n')
+            self._fh.write(line)
+            self._pending += 1
+            if self._pending >= self.sync_every or time.time() - self._last_sync >= self.sync_interval:
+                self._sync_locked()
+
+    def maybe_sync(self):
+        """距上次fsync超过间隔时刷盘（由调度循环定期调用）"""
+        with self._lock:
+            if self._pending and time.time() - self._last_sync >= self.sync_interval:
+                self._sync_locked()
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self):
+        if self._fh is not None and self._pending:
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+        self._pending = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        with self._lock:
+            self._sync_locked()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def replay(self):
+        """读取所有未合并的记录（.compacting段在前，按写入顺序）"""
+        self.sync()
+        return read_journal(self.compacting_path) + read_journal(self.path)
+
+    def rotate(self):
+        """将当前日志轮换到 .compacting 段，返回该段涉及的文件名集合"""
+        with self._lock:
+            self._sync_locked()
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            if os.path.isfile(self.path):
+                if os.path.isfile(self.compacting_path):
+                    # 上次合并未完成：把新记录接到旧段后面
+                    with open(self.path, 'rb') as src, open(self.compacting_path, 'ab') as dst:
+                        shutil.copyfileobj(src, dst)
+                    os.remove(self.path)
+                else:
+                    os.replace(self.path, self.compacting_path)
+        return {rec['file'] for rec in read_journal(self.compacting_path)}
+
+    def is_empty(self):
+        """是否没有任何待合并的记录"""
+        self.sync()
+        return not any(os.path.isfile(p) and os.path.getsize(p) > 0
+                       for p in (self.path, self.compacting_path))
+
+    def discard_rotated(self):
+        """合并成功后删除 .compacting 段"""
+        if os.path.isfile(self.compacting_path):
+            os.remove(self.compacting_path)
+
+
+# ==================== 翻译记忆 ====================
+
+TM_NAME = 'translation_memory.jsonl'
+
+
+def normalize_source(text):
+    """翻译记忆/去重用的原文规范化：去掉首尾空白，连续空白合并为一个空格"""
+    return ' '.join((text or '').split())
+
+
+def prompt_hash(prompt):
+    """提示词的短哈希：换了提示词的旧译文不再当作精确匹配"""
+    return hashlib.sha1((prompt or '').encode('utf-8')).hexdigest()[:12]
+
+
+class TranslationMemory:
+    """精确匹配的翻译记忆：(规范化英文, 提示词哈希, 模型) -> 译文
+
+    追加式JSONL，首次使用时整体读入内存，同一组合以最后一条为准。
+    放在CSV目录里，重新导出新版本游戏文本后依然可以复用。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._loaded = False
+        self._lock = threading.Lock()
+        self._fh = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def load(self):
+        """读取记忆文件（只读一次），返回条数"""
+        with self._lock:
+            if not self._loaded:
+                self._loaded = True
+                if os.path.isfile(self.path):
+                    with open(self.path, 'r', encoding='utf-8', errors='replace') as f:
+                        for line in f:
+                            line = line.strip()
+                            if not line:
+                                continue
+                            try:
+                                rec = json.loads(line)
+                            except ValueError:
+                                continue
+                            if isinstance(rec, dict) and rec.get('en') and isinstance(rec.get('text'), str):
+                                self._entries[(rec['en'], rec.get('p', ''), rec.get('m', ''))] = rec['text']
+            return len(self._entries)
+
+    def get(self, en, p_hash, model):
+        return self._entries.get((normalize_source(en), p_hash, model))
+
+    def get_any(self, en, p_hash, models):
+        """按顺序查找多个模型的译文，返回第一个命中"""
+        for model in models:
+            text = self.get(en, p_hash, model)
+            if text is not None:
+                return text
+        return None
+
+    def put(self, en, p_hash, model, text):
+        """记录一条译文（内容没变时不重复写入）"""
+        entry = (normalize_source(en), p_hash, model)
+        with self._lock:
+            if self._entries.get(entry) == text:
+                return
+            self._entries[entry] = text
+            if self._fh is None:
+                self._fh = open(self.path, 'a', encoding='utf-8')
+                # 崩溃时可能留下半行，先补换行避免与新记录粘连
+                if self._fh.tell() > 0:
+                    with open(self.path, 'rb') as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b'\n':
+                            self._fh.write('\n')
+            rec = {'en': entry[0], 'p': p_hash, 'm': model, 'text': text}
+            self._fh.write(json.dumps(rec, ensure_ascii=False) + '\n')
+
+    def fuzzy_index(self, p_hash, models):
+        """用全部记忆构建模糊匹配索引；同一原文优先取当前提示词+本次任务所用模型的译文"""
+        best = {}
+        with self._lock:
+            for (en, p, m), text in self._entries.items():
+                reusable = (p == p_hash and m in models)
+                if reusable or en not in best:
+                    best[en] = (text, reusable)
+        index = FuzzyMemory()
+        for en, (text, reusable) in best.items():
+            index.add(en, text, reusable)
+        return index
+
+    def flush(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.flush()
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+
+# 每批请求附带的模糊匹配参考译文上限
+FUZZY_EXAMPLES_PER_BATCH = 8
+# 原文中可被替换的变量：数字与 {占位符}
+_VARIABLE_RE = re.compile(r'\d+(?:\.\d+)?|\{[^{}]*\}')
+
+
+def _split_variables(text):
+    """拆出原文骨架（变量替换为\x00）与按顺序出现的变量列表"""
+    return _VARIABLE_RE.sub('\x00', text), _VARIABLE_RE.findall(text)
+
+
+class FuzzyMemory:
+    """离线模糊匹配：字符n-gram倒排索引 + Dice相似度
+
+    - derive()：与已有原文只差数字/占位符（骨架相同）时，按对应关系改写已有译文直接套用；
+    - similar()：找出最相近的已有译文，作为few-shot示例附在请求里。
+    只有与当前提示词、模型一致的条目才允许直接套用，其余只作示例。
+    """
+
+    def __init__(self, n=3):
+        self.n = n
+        self._texts = []
+        self._trans = []
+        self._grams = []
+        self._index = {}
+        self._skeletons = {}
+
+    def __len__(self):
+        return len(self._texts)
+
+    def _ngrams(self, text):
+        s = re.sub(r'\d+', '#', text.lower())
+        n = self.n
+        if len(s) <= n:
+            return {s} if s else set()
+        return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+    def add(self, en, text, reusable=True):
+        en = normalize_source(en)
+        if not en or not text:
+            return
+        idx = len(self._texts)
+        grams = self._ngrams(en)
+        self._texts.append(en)
+        self._trans.append(text)
+        self._grams.append(grams)
+        for g in grams:
+            self._index.setdefault(g, []).append(idx)
+        if reusable:
+            self._skeletons[_split_variables(en)[0]] = idx
+
+    def derive(self, en):
+        """与已有原文只差数字/占位符时，返回改写后的译文，否则返回None"""
+        skeleton, new_vars = _split_variables(normalize_source(en))
+        idx = self._skeletons.get(skeleton)
+        if idx is None or not new_vars:
+            return None
+        mapping = {}
+        for old, new in zip(_split_variables(self._texts[idx])[1], new_vars):
+            if mapping.setdefault(old, new) != new:
+                return None  # 同一个旧值对应了不同的新值，无法确定替换
+        used = set()
+        unknown = []
+
+        def replace(m):
+            token = m.group(0)
+            if token not in mapping:
+                unknown.append(token)
+                return token
+            used.add(token)
+            return mapping[token]
+
+        result = _VARIABLE_RE.sub(replace, self._trans[idx])
+        # 译文里每个变量都要能对上原文，原文变量也都要出现在译文里（否则可能是意译过的数字）
+        if unknown or used != set(mapping):
+            return None
+        return result
+
+    def similar(self, en, k=2, threshold=0.6):
+        """返回最相近的k条 [(相似度, 英文, 译文)]"""
+        grams = self._ngrams(normalize_source(en))
+        if not grams or not self._texts:
+            return []
+        counts = {}
+        # 极常见的n-gram区分度低，跳过以控制候选数量
+        limit = max(64, len(self._texts) // 20)
+        for g in grams:
+            ids = self._index.get(g)
+            if ids and len(ids) <= limit:
+                for i in ids:
+                    counts[i] = counts.get(i, 0) + 1
+        best = sorted(counts, key=counts.get, reverse=True)[:20]
+        results = []
+        for i in best:
+            other = self._grams[i]
+            score = 2 * len(grams & other) / (len(grams) + len(other))
+            if score >= threshold:
+                results.append((score, self._texts[i], self._trans[i]))
+        results.sort(key=lambda r: -r[0])
+        return results[:k]
+
+
+# ==================== 标签遮蔽 ====================
+
+# 发给模型前替换成 <1> <2> … 的游戏标签：[img:…] [b] [/b] [s:N] {catname} 等
+_MASK_TAG_RE = re.compile(r'\[[^\]]*\]|\{[^}]*\}')
+_MASK_TOKEN_RE = re.compile(r'<(\d+)>')
+
+
+def mask_tags(text):
+    """把标签替换为短标记，返回 (遮蔽后的文本, 标签列表)；第i个标签对应 <i+1>
+
+    原文本身含有 <数字> 时不遮蔽，避免与标记混淆。
+    """
+    if _MASK_TOKEN_RE.search(text):
+        return text, []
+    masks = []
+
+    def replace(m):
+        masks.append(m.group(0))
+        return f'<{len(masks)}>'
+
+    return _MASK_TAG_RE.sub(replace, text), masks
+
+
+def unmask_tags(text, masks):
+    """还原标记；每个标记必须恰好出现一次，否则返回None（交给重试）"""
+    if not masks:
+        return text
+    found = _MASK_TOKEN_RE.findall(text)
+    if sorted(found, key=int) != [str(i) for i in range(1, len(masks) + 1)]:
+        return None
+    return _MASK_TOKEN_RE.sub(lambda m: masks[int(m.group(1)) - 1], text)
+
+
+# 每批固定不变的翻译要求，追加在系统提示词之后。
+# 可变内容（术语、参考译文、待翻译JSON）都放在用户消息里，
+# 这样各批请求的前缀逐字节相同，服务端的前缀缓存可以命中。
+BATCH_INSTRUCTION = (
+    "## 输出要求\n"
+    "用户消息末尾是待翻译的JSON：将其中的英文值翻译为中文，保持key不变，直接返回翻译后的JSON。"
+    "不要添加任何解释或markdown格式。\n"
+    "文本中形如<1>的标记代表游戏标签，必须原样保留在译文中的对应位置。\n"
+    "用户消息中提供的术语必须统一使用；相似原文的已有译文仅供参考，不要翻译这部分。"
+)
+
+
+# ==================== 术语表注入 ====================
+
+# 英文术语后允许的词尾变化（Stacks、Bleeding 等仍算命中）
+_GLOSSARY_SUFFIXES = ('', 's', 'es', 'ed', 'ing')
+
+
+def split_glossary(prompt):
+    """从提示词中拆出标题含「术语表」的小节，返回 (其余提示词, [(英文, 中文)])
+
+    小节内形如 Shield=护盾, Bleed=流血 的条目被拆出，其余行原样保留；没有术语表时原样返回。
+    """
+    kept = []
+    entries = []
+    in_glossary = False
+    for line in prompt.split('\n'):
+        if line.lstrip().startswith('#'):
+            in_glossary = '术语表' in line
+            if in_glossary:
+                continue
+        if in_glossary and '=' in line:
+            for part in re.split(r'[,，]', line):
+                en, sep, zh = part.partition('=')
+                if sep and en.strip() and zh.strip():
+                    entries.append((en.strip(), zh.strip()))
+            continue
+        kept.append(line)
+    if not entries:
+        return prompt, []
+    return '\n'.join(kept).rstrip(), entries
+
+
+def format_glossary(entries):
+    return "## 本批涉及的术语（必须统一）\n" + ', '.join(f"{en}={zh}" for en, zh in entries)
+
+
+class GlossaryMatcher:
+    """Aho–Corasick 多模式匹配：一次扫描找出文本中出现的全部术语
+
+    不区分大小写，按整词匹配（允许常见英文词尾变化）。
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._terms = [en.lower() for en, _ in entries]
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for idx, term in enumerate(self._terms):
+            node = 0
+            for ch in term:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][ch] = nxt
+                node = nxt
+            self._out[node].append(idx)
+        # 广度优先建立失配指针
+        pending = deque(self._goto[0].values())
+        while pending:
+            node = pending.popleft()
+            for ch, nxt in self._goto[node].items():
+                pending.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def _is_word(self, text, start, end):
+        if start > 0 and text[start - 1].isalnum():
+            return False
+        for suffix in _GLOSSARY_SUFFIXES:
+            stop = end + len(suffix)
+            if text.startswith(suffix, end) and (stop >= len(text) or not text[stop].isalnum()):
+                return True
+        return False
+
+    def find(self, text):
+        """返回文本中出现的术语下标集合"""
+        found = set()
+        low = text.lower()
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(low):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for idx in out[node]:
+                if idx not in found and self._is_word(low, i + 1 - len(self._terms[idx]), i + 1):
+                    found.add(idx)
+        return found
+
+    def select(self, texts):
+        """多段文本中出现过的术语条目（保持术语表原顺序）"""
+        found = set()
+        for text in texts:
+            found |= self.find(text)
+        return [self.entries[i] for i in sorted(found)]
+
+
+# ==================== 并发控制 ====================
+
+def is_overload_error(exc):
+    """429限频或超时：说明并发已超过服务端承受能力"""
+    status = getattr(exc, 'status_code', None)
+    if status == 429:
+        return True
+    name = type(exc).__name__
+    if 'Timeout' in name or 'RateLimit' in name:
+        return True
+    err_str = str(exc).lower()
+    return '429' in err_str or 'rate limit' in err_str or 'timed out' in err_str or 'timeout' in err_str
+
+
+# 额度用尽/欠费的错误信息特征（部分服务以429返回，不能当作普通限频重试）
+_QUOTA_MARKERS = ('insufficient_quota', 'exceeded your current quota', 'insufficient balance',
+                  'arrearage', '余额不足', '欠费')
+
+
+def is_route_unusable(exc):
+    """密钥无效/被吊销(401/403)、模型不存在(404)或额度用尽(402等)：这个密钥+模型不会再成功"""
+    status = getattr(exc, 'status_code', None)
+    if status in (401, 402, 403, 404):
+        return True
+    err_str = str(exc).lower()
+    return any(marker in err_str for marker in _QUOTA_MARKERS)
+
+
+def split_api_keys(text):
+    """把密钥输入拆成列表：多个密钥用逗号、分号或空白分隔，重复的只保留一个"""
+    return list(dict.fromkeys(k for k in re.split(r'[,，;；\s]+', text) if k))
+
+
+def estimate_tokens(text):
+    """粗略估算token数：ASCII约4字符1个token，CJK等非ASCII字符约每字1个"""
+    if not text:
+        return 0
+    ascii_count = len(text.encode('ascii', 'ignore'))
+    return (ascii_count + 3) // 4 + (len(text) - ascii_count)
+
+
+def cached_prompt_tokens(usage):
+    """从用量信息中取出命中前缀缓存的输入token数
+
+    OpenAI兼容接口放在 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens。
+    """
+    details = getattr(usage, 'prompt_tokens_details', None)
+    if isinstance(details, dict):
+        cached = details.get('cached_tokens')
+    else:
+        cached = getattr(details, 'cached_tokens', None)
+    if not cached:
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)
+    return cached if isinstance(cached, int) else 0
+
+
+# 单批译文的输出token预算：整批译文要远低于模型输出上限，避免 finish_reason=length 截断
+BATCH_OUTPUT_TOKENS = 3000
+# 模型名中看不出上下文长度时按此估计
+DEFAULT_CONTEXT_TOKENS = 32768
+
+
+def batch_token_budget(model, sys_prompt='', framing_tokens=0):
+    """按模型估算单批可用的(输入, 输出)token预算
+
+    sys_prompt: 实际发送的系统消息；framing_tokens: 用户消息中待翻译JSON以外的部分（术语、参考译文）
+    """
+    m = re.search(r'(\d+)k\b', model.lower())
+    context = int(m.group(1)) * 1024 if m else DEFAULT_CONTEXT_TOKENS
+    output = min(BATCH_OUTPUT_TOKENS, context // 4)
+    # 输入部分扣掉系统消息和用户消息框架，另留小节标题与估算误差的余量
+    return max(256, context - output - estimate_tokens(sys_prompt) - framing_tokens - 256), output
+
+
+def estimate_item_tokens(key, en):
+    """单条在批量JSON中的(输入, 输出)token估算；中文译文按英文字符数的一半计"""
+    key_tokens = estimate_tokens(key) + 4  # 引号、冒号、逗号
+    return key_tokens + estimate_tokens(en), key_tokens + (len(en) + 1) // 2
+
+
+def pack_batches(items, budget, max_items):
+    """按token预算把 [(key, langs)] 切成连续的批次
+
+    顺序贪心：当前批再放一条就会超出输入/输出预算或条数上限时另起一批。
+    对保持原顺序的切分而言贪心得到的批数就是最少的；单条超预算时独占一批。
+    """
+    in_budget, out_budget = budget
+    batches = []
+    batch = []
+    in_used = out_used = 0
+    for item in items:
+        in_tok, out_tok = estimate_item_tokens(item[0], item[1].get('en', ''))
+        if batch and (len(batch) >= max_items or in_used + in_tok > in_budget
+                      or out_used + out_tok > out_budget):
+            batches.append(batch)
+            batch = []
+            in_used = out_used = 0
+        batch.append(item)
+        in_used += in_tok
+        out_used += out_tok
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _parse_reset_seconds(value):
+    """解析限额重置时间：'1s' / '6m0s' / '20ms' / '0.5' 等格式，返回秒数"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for num, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value):
+        matched = True
+        total += float(num) * {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}[unit]
+    return total if matched else None
+
+
+def retry_after_seconds(headers):
+    """从 Retry-After / retry-after-ms 响应头读取等待秒数"""
+    if not headers:
+        return None
+    ms = headers.get('retry-after-ms')
+    if ms is not None:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    return _parse_reset_seconds(headers.get('retry-after'))
+
+
+class TokenBucket:
+    """每分钟额度的令牌桶，允许预约为负数：欠下的额度按补充速度折算成等待时间
+
+    桶容量只有 burst_seconds 秒的额度：服务端往往按更短的窗口执行每分钟限额，
+    不能在一开始就把整分钟的额度一次发完。
+    """
+
+    def __init__(self, per_minute, burst_seconds=5):
+        self.burst_seconds = burst_seconds
+        self.per_minute = per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.per_minute * self.burst_seconds / 60.0)
+
+    def _refill(self, now):
+        rate = self.per_minute / 60.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def reserve(self, amount, now):
+        """预约amount额度，返回需要等待的秒数
+
+        按全额扣除，余额为负时折算成等待；只有超过整分钟额度的单次请求按一分钟额度计，避免永远等不到。
+        """
+        self._refill(now)
+        self.tokens -= self.charge(amount)
+        return max(0.0, -self.tokens * 60.0 / self.per_minute)
+
+    def charge(self, amount):
+        """一次预约实际扣除的额度"""
+        return min(amount, self.per_minute)
+
+    def refund(self, amount, now):
+        self._refill(now)
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+    def sync(self, limit=None, remaining=None, now=None):
+        """按服务端响应头校准：上限以服务端为准，剩余额度只下调不上调"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if limit:
+            self.per_minute = limit
+            self.tokens = min(self.tokens, self.capacity)
+        if remaining is not None:
+            self.tokens = min(self.tokens, remaining)
+
+
+# 各供应商的RPM/TPM预设（None=不限），按模型名覆盖供应商默认值。
+# 只是提示值：开始时不限速，遇到429且响应头没有给出限额时才按预设限速；
+# 响应头中的 x-ratelimit-* 始终以服务端为准（可高于预设）。
+PROVIDER_RATE_LIMITS = {
+    '智谱AI (Zhipu)': {'*': (600, 1000000)},
+    'DeepSeek': {'*': (None, None)},
+    '通义千问 (Qwen)': {'*': (1200, 1000000)},
+    'Moonshot/Kimi': {'*': (200, 2000000)},
+    '硅基流动 (SiliconFlow)': {'*': (1000, 50000)},
+    'OpenAI': {'*': (500, 200000), 'gpt-4o': (500, 30000)},
+}
+
+
+class ProviderRateLimiter:
+    """单个(供应商, 模型)的RPM/TPM令牌桶限速器（asyncio）
+
+    发送前按估算token数预约额度并等待；收到响应后按实际用量结算，
+    并用 x-ratelimit-* 响应头校准上限与剩余额度；429时按 Retry-After 整体暂停。
+    rpm/tpm 只是预设提示：在响应头给出限额或遇到429之前不限速。
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self.requests = None
+        self.tokens = None
+        self.hint = (rpm, tpm)
+        self.blocked_until = 0.0
+
+    def describe(self):
+        rpm = int(self.requests.per_minute) if self.requests else '不限'
+        tpm = int(self.tokens.per_minute) if self.tokens else '不限'
+        text = f"RPM {rpm} | TPM {tpm}"
+        hint_rpm, hint_tpm = self.hint
+        if (hint_rpm and not self.requests) or (hint_tpm and not self.tokens):
+            text += f"（遇到限频后按预设 RPM {hint_rpm or '不限'} | TPM {hint_tpm or '不限'}）"
+        return text
+
+    def blocked_for(self):
+        return max(0.0, self.blocked_until - time.monotonic())
+
+    async def acquire(self, est_tokens):
+        """等待直到本次请求的额度可用"""
+        now = time.monotonic()
+        wait = self.blocked_until - now
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1, now))
+        if self.tokens:
+            wait = max(wait, self.tokens.reserve(est_tokens, now))
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                self.release(1, est_tokens)
+                raise
+
+    def release(self, requests=0, tokens=0):
+        """退还未使用的预约额度"""
+        now = time.monotonic()
+        if self.requests and requests:
+            self.requests.refund(requests, now)
+        if self.tokens and tokens:
+            self.tokens.refund(tokens, now)
+
+    def settle(self, est_tokens, actual_tokens):
+        """按实际用量结算（估多了退还，估少了补扣）"""
+        if self.tokens and actual_tokens:
+            self.tokens.refund(self.tokens.charge(est_tokens) - actual_tokens, time.monotonic())
+
+    def block_for(self, seconds):
+        """暂停发送seconds秒；清空已积攒的请求额度，恢复后按速率逐个发出而不是一拥而上"""
+        now = time.monotonic()
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        if self.requests:
+            self.requests._refill(now)
+            self.requests.tokens = min(self.requests.tokens, 0.0)
+
+    def throttled(self, seconds):
+        """收到429：响应头没给出限额的维度改按预设限速（从空桶开始），并暂停seconds秒"""
+        hint_rpm, hint_tpm = self.hint
+        if self.requests is None and hint_rpm:
+            self.requests = TokenBucket(hint_rpm)
+            self.requests.tokens = 0.0
+        if self.tokens is None and hint_tpm:
+            self.tokens = TokenBucket(hint_tpm)
+            self.tokens.tokens = 0.0
+        self.block_for(seconds)
+
+    def observe_headers(self, headers):
+        """从响应头学习实际限额"""
+        if not headers:
+            return
+
+        def num(name):
+            try:
+                return float(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        limit_req, remain_req = num('x-ratelimit-limit-requests'), num('x-ratelimit-remaining-requests')
+        limit_tok, remain_tok = num('x-ratelimit-limit-tokens'), num('x-ratelimit-remaining-tokens')
+        # 之前不知道限额、一直在不受限地发送：新建的桶从空桶开始
+        if limit_req or remain_req is not None:
+            if self.requests is None and limit_req:
+                self.requests = TokenBucket(limit_req)
+                self.requests.tokens = 0.0
+            if self.requests:
+                self.requests.sync(limit_req, remain_req)
+        if limit_tok or remain_tok is not None:
+            if self.tokens is None and limit_tok:
+                self.tokens = TokenBucket(limit_tok)
+                self.tokens.tokens = 0.0
+            if self.tokens:
+                self.tokens.sync(limit_tok, remain_tok)
+        # 额度已用尽时直接等到重置
+        if remain_req == 0:
+            reset = _parse_reset_seconds(headers.get('x-ratelimit-reset-requests'))
+            if reset:
+                self.block_for(reset)
+        if remain_tok == 0:
+            reset = _parse_reset_seconds(headers.get('x-ratelimit-reset-tokens'))
+            if reset:
+                self.block_for(reset)
+
+
+# (base_url, model, 密钥) -> ProviderRateLimiter，同一会话内多次翻译共享已学到的限额
+_RATE_LIMITERS = {}
+
+
+def rate_limiter_for(provider_name, base_url, model, api_key=''):
+    """获取(供应商, 模型, 密钥)共享的限速器，首次创建时带上预设的RPM/TPM提示
+
+    限额按密钥计算，同一供应商的多个密钥各自限速。
+    """
+    key = (base_url.rstrip('/'), model, api_key)
+    limiter = _RATE_LIMITERS.get(key)
+    if limiter is None:
+        presets = PROVIDER_RATE_LIMITS.get(provider_name, {})
+        rpm, tpm = presets.get(model, presets.get('*', (None, None)))
+        limiter = _RATE_LIMITERS[key] = ProviderRateLimiter(rpm, tpm)
+    return limiter
+
+
+class AdaptiveLimiter:
+    """AIMD自适应并发上限（asyncio，仅在事件循环线程内使用）
+
+    每个请求 acquire() 取得名额，结束时 release(ticket, outcome) 反馈结果：
+    - 'ok'：延迟与错误率都正常时加性增长，每满一个窗口（当前上限个成功请求）上限 +1；
+    - 'overload'（429/超时）：上限减半。同一次拥塞只减一次——
+      在上次减半之前就已发出的请求再失败不会继续减；
+    - 'error'（解析失败等）或 None（被取消）：只计入错误率，不调整上限。
+    延迟健康 = 近期延迟的EWMA不超过历史最好水平的 latency_tolerance 倍。
+    """
+
+    def __init__(self, max_limit, initial=4, min_limit=1,
+                 latency_tolerance=2.0, max_error_rate=0.1):
+        self.max_limit = max(min_limit, int(max_limit))
+        self.min_limit = min_limit
+        self.limit = float(min(self.max_limit, max(min_limit, initial)))
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.inflight = 0
+        self.decreases = 0
+        self._waiters = deque()
+        self._latency = None
+        self._best_latency = None
+        self._error_rate = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def current(self):
+        return int(self.limit)
+
+    async def acquire(self):
+        """等待空闲名额，返回本次请求的票据（发出时间）"""
+        await self.wait_available()
+        self.inflight += 1
+        return time.monotonic()
+
+    async def wait_available(self):
+        """等到有空闲名额但不占用：把发送前的准备工作推迟到轮到自己时再做"""
+        while self.inflight >= int(self.limit):
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+                elif fut.done() and not fut.cancelled():
+                    # 已被唤醒却被取消：把名额让给下一个
+                    self._wake()
+                raise
+
+    def release(self, ticket, outcome, latency=None):
+        """归还名额并按结果调整上限，返回上限是否被减半"""
+        self.inflight -= 1
+        decreased = False
+        if outcome is not None:
+            self._error_rate = 0.9 * self._error_rate + (0.1 if outcome != 'ok' else 0.0)
+        if outcome == 'ok':
+            if latency is not None:
+                self._latency = latency if self._latency is None else 0.7 * self._latency + 0.3 * latency
+                if self._best_latency is None or self._latency < self._best_latency:
+                    self._best_latency = self._latency
+            healthy_latency = (self._latency is None or
+                               self._latency <= self._best_latency * self.latency_tolerance)
+            if healthy_latency and self._error_rate <= self.max_error_rate:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        elif outcome == 'overload' and ticket >= self._last_decrease:
+            self.limit = max(self.min_limit, self.limit / 2)
+            self._last_decrease = time.monotonic()
+            self.decreases += 1
+            decreased = True
+        self._wake()
+        return decreased
+
+    def pass_turn(self):
+        """wait_available() 之后决定不发请求时调用，避免空闲名额无人认领"""
+        self._wake()
+
+    def _wake(self):
+        free = int(self.limit) - self.inflight
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+
+# ==================== 多线路调度 ====================
+
+def parse_route_lines(text, keys_text=''):
+    """解析「备用线路」文本：每行 `供应商名称或API地址 | 模型`，#开头为注释
+
+    密钥不写在线路文本里：keys_text 按线路顺序用 | 分隔各线路的密钥，
+    一条线路可填多个密钥（逗号分隔），留空表示沿用主线路的密钥。
+    返回 [{'provider','base_url','api_keys','model'}]，格式错误时抛出ValueError。
+    """
+    providers = {name: url for name, url, _ in AI_PROVIDERS}
+    key_groups = [group.strip() for group in keys_text.split('|')] if keys_text.strip() else []
+    routes = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) != 2 or not parts[0] or not parts[1]:
+            raise ValueError(f"备用线路第{lineno}行格式应为: 供应商或API地址 | 模型")
+        target, model = parts
+        if target in providers and providers[target]:
+            provider, base_url = target, providers[target]
+        elif target.startswith(('http://', 'https://')):
+            # 直接填写地址时按地址匹配已知供应商，以便使用预设的速率限制
+            base_url = target
+            provider = next((name for name, url in providers.items()
+                             if url and url.rstrip('/') == target.rstrip('/')), target)
+        else:
+            raise ValueError(f"备用线路第{lineno}行: 未知供应商 {target}（可填写API地址）")
+        keys = key_groups[len(routes)] if len(routes) < len(key_groups) else ''
+        routes.append({'provider': provider, 'base_url': base_url, 'api_keys': split_api_keys(keys), 'model': model})
+    if len(key_groups) > len(routes):
+        raise ValueError(f"备用线路密钥有 {len(key_groups)} 组，但只有 {len(routes)} 条备用线路")
+    return routes
+
+
+class RouteBalancer:
+    """在多条线路（供应商+密钥+模型）之间加权分配请求并自动故障转移（asyncio，仅在事件循环线程内使用）
+
+    同一供应商的每个密钥都是一条独立线路，有自己的RPM/TPM限速器和AIMD并发控制器。发送时在有空闲名额的线路中按权重随机选择：
+    权重 = 成功率² / 延迟EWMA，慢或出错多的线路分到的请求自动减少；
+    正在按429暂停或处于冷却中的线路只在别无选择时使用。
+    连续出错的线路冷却一段时间；密钥失效、额度用尽或模型不存在的线路停用，其余线路接手。
+    对外提供与 AdaptiveLimiter 相同的 wait_available / pass_turn / current / max_limit。
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        for route in routes:
+            route.update({'latency': None, 'error_rate': 0.0, 'failures': 0, 'cooldown_until': 0.0,
+                          'disabled': False, 'sent': 0, 'ok': 0, 'errors': 0})
+        self._waiters = deque()
+
+    @property
+    def current(self):
+        return sum(route['limiter'].current for route in self.active())
+
+    @property
+    def max_limit(self):
+        return sum(route['limiter'].max_limit for route in self.active())
+
+    def active(self):
+        return [route for route in self.routes if not route['disabled']]
+
+    def paused_for(self, route, now=None):
+        """线路还需暂停的秒数（429等待或出错冷却）"""
+        now = time.monotonic() if now is None else now
+        return max(route['rate'].blocked_for(), route['cooldown_until'] - now, 0.0)
+
+    def blocked_for(self):
+        """最早恢复的线路还需等待的秒数"""
+        now = time.monotonic()
+        return min((self.paused_for(route, now) for route in self.active()), default=0.0)
+
+    def weight(self, route):
+        latency = route['latency']
+        if latency is None:
+            # 还没有数据的线路按已知最快的线路估计，保证每条线路都会被试到
+            known = [r['latency'] for r in self.routes if r['latency'] is not None]
+            latency = min(known) if known else 1.0
+        return (1.0 - route['error_rate']) ** 2 / max(latency, 0.05)
+
+    def _free(self):
+        return [route for route in self.active()
+                if route['limiter'].inflight < int(route['limiter'].limit)]
+
+    def pick(self):
+        """在有空闲名额的线路中选一条，没有则返回None"""
+        free = self._free()
+        if not free:
+            return None
+        now = time.monotonic()
+        ready = [route for route in free if self.paused_for(route, now) <= 0]
+        if not ready:
+            return min(free, key=lambda route: self.paused_for(route, now))
+        return random.choices(ready, [self.weight(route) for route in ready])[0]
+
+    async def wait_available(self):
+        """等到某条线路有空闲名额但不占用；所有线路都已停用时直接返回"""
+        while self.active() and not self._free():
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            try:
+                await fut
+            except asyncio.CancelledError:
+                if fut in self._waiters:
+                    self._waiters.remove(fut)
+                elif fut.done() and not fut.cancelled():
+                    self._wake()
+                raise
+
+    async def acquire(self):
+        """选定线路并占用名额，返回 (线路, 票据)；所有线路都已停用时返回 (None, None)"""
+        await self.wait_available()
+        route = self.pick()
+        if route is None:
+            return None, None
+        route['sent'] += 1
+        # 选中的线路一定有空闲名额，这里不会等待
+        return route, await route['limiter'].acquire()
+
+    def release(self, route, ticket, outcome, latency=None, fatal=False):
+        """归还名额并更新线路健康度，返回该线路的并发上限是否被减半"""
+        decreased = route['limiter'].release(ticket, outcome, latency)
+        if outcome is not None:
+            route['error_rate'] = 0.8 * route['error_rate'] + (0.2 if outcome != 'ok' else 0.0)
+        if outcome == 'ok':
+            route['ok'] += 1
+            route['failures'] = 0
+            if latency is not None:
+                route['latency'] = latency if route['latency'] is None else 0.7 * route['latency'] + 0.3 * latency
+        elif outcome is not None:
+            route['errors'] += 1
+            if outcome == 'error':
+                route['failures'] += 1
+                if route['failures'] >= 3:
+                    # 连续出错：冷却时间从5秒起翻倍，最长1分钟
+                    route['cooldown_until'] = time.monotonic() + min(60.0, 5.0 * 2 ** (route['failures'] - 3))
+        if fatal:
+            route['disabled'] = True
+        self._wake()
+        return decreased
+
+    def pass_turn(self):
+        """wait_available() 之后决定不发请求时调用，避免空闲名额无人认领"""
+        self._wake()
+
+    def _wake(self):
+        free = sum(int(route['limiter'].limit) - route['limiter'].inflight for route in self.active())
+        while free > 0 and self._waiters:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                free -= 1
+
+    def summary(self):
+        """每条线路的请求统计，供结束时写日志"""
+        lines = []
+        for route in self.routes:
+            latency = f"{route['latency']:.1f}s" if route['latency'] is not None else '-'
+            state = '（已停用）' if route['disabled'] else ''
+            lines.append(f"{route['name']}: 请求 {route['sent']}，成功 {route['ok']}，出错 {route['errors']}，"
+                         f"延迟≈{latency}，并发上限 {route['limiter'].current}{state}")
+        return lines
+
+
+# ==================== 界面消息桥 ====================
+
+class UiBridge:
+    """后台线程 → Tk主线程的消息队列
+
+    Tk 不是线程安全的：工作线程（包括翻译事件循环）只往队列里放回调，
+    由主线程定时取出执行。
+    """
+
+    def __init__(self, root, interval_ms=50, max_per_tick=500):
+        self.root = root
+        self.interval_ms = interval_ms
+        self.max_per_tick = max_per_tick
+        self._queue = queue.Queue()
+
+    def post(self, fn, *args):
+        """可在任意线程调用"""
+        self._queue.put((fn, args))
+
+    def start(self):
+        self.root.after(self.interval_ms, self._drain)
+
+    def _drain(self):
+        # 每次最多处理 max_per_tick 条，日志刷屏时界面也能响应
+        for _ in range(self.max_per_tick):
+            try:
+                fn, args = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                fn(*args)
+            except Exception:
+                import traceback
+                traceback.print_exc()
+        self.root.after(self.interval_ms, self._drain)
+
+
 # ==================== GUI主界面 ====================
 
 class TranslationToolApp:
@@ -531,7 +2713,7 @@ class TranslationToolApp:
         self.gpak_path = None
         self.entries = None
         self.data_start = None
-        # {csv_name: {key: {lang: text}}} — 从GPAK读取的多语言数据
+        # {csv_name: CorpusTable} — 从GPAK读取的多语言数据（列式存储）
         self.all_data = {}
         # {csv_name: {key: cn_text}} — 中文翻译
         self.translations = {}
@@ -542,16 +2724,53 @@ class TranslationToolApp:
         # AI翻译线程控制
         self.translate_running = False
         self.translate_stop_event = threading.Event()
+        # 后台线程更新界面统一走消息桥
+        self._ui = UiBridge(root)
+        self._ui.start()
+        # 翻译时的自适应并发控制器（显示在Token统计行）
+        self._limiter = None
         # Token用量统计
         self.total_prompt_tokens = 0
         self.total_completion_tokens = 0
         self.total_tokens = 0
+        self.glossary_saved_tokens = 0
+        self.cached_prompt_tokens = 0
+        # AI翻译结果的追加式日志（按CSV目录创建）；早于本次启动的记录才需要重放
+        self._journal = None
+        self._journal_lock = threading.Lock()
+        self._started = round(time.time(), 3)  # 与日志记录的 ts 精度一致
+        self._recovering = False
+        # 翻译记忆（与日志同在CSV目录）
+        self._tm = None
+        self._compact_lock = threading.Lock()
+        # 退出前正在后台合并日志
+        self._closing = False
+        # CSV目录同步：后台导出线程 + 已读取文件的 (mtime_ns, size)
+        self._export_thread = None
+        self._csv_read_stamps = {}
+        # 导出进行中时主线程的写CSV操作排到导出完成后执行
+        self._after_export = []
+        # 排队等待导出完成后写回的手动编辑（文件名）
+        self._unsaved_edits = set()
+        # 换行检查（增量）
+        self._wrap_linter = WrapLinter()
+        self._lint_running = False
+        self._save_running = False
 
         self._build_ui()
+        self.root.protocol('WM_DELETE_WINDOW', self._on_close)
         # 尝试自动定位游戏目录
         detected = find_game_dir()
         if detected:
             self.game_dir_var.set(detected)
+        # 上次运行（如崩溃）留在默认CSV目录的未合并日志：启动时即在后台重放并合并回CSV
+        if os.path.isdir(self._default_csv_dir()):
+            self._get_csv_dir()
+            self._recover_in_background(self._on_startup_recovered)
+
+    def _on_startup_recovered(self, count):
+        if count:
+            self.status_var.set(f"已恢复上次未合并的翻译日志（{count} 个CSV文件）")
 
     def _build_ui(self):
         """构建界面"""
@@ -585,6 +2804,7 @@ class TranslationToolApp:
         toolbar = ttk.Frame(tab)
         toolbar.pack(fill='x', pady=(0, 5))
         ttk.Button(toolbar, text="从游戏导出CSV文本", command=self._read_gpak).pack(side='left', padx=2)
+        ttk.Button(toolbar, text="保存翻译到CSV", command=self._save_journal_now).pack(side='left', padx=2)
 
         ttk.Separator(toolbar, orient='vertical').pack(side='left', padx=8, fill='y')
         ttk.Label(toolbar, text="文件:").pack(side='left')
@@ -687,7 +2907,9 @@ class TranslationToolApp:
         self.api_key_var = tk.StringVar()
         self.api_key_entry = ttk.Entry(config, textvariable=self.api_key_var, width=50, show='*')
         self.api_key_entry.grid(row=2, column=1, sticky='we', padx=5, pady=(5, 0))
-        self.btn_toggle_key = ttk.Button(config, text="显示", command=self._toggle_api_key, width=6)
+        self.btn_toggle_key = ttk.Button(
+            config, text="显示", width=6,
+            command=lambda: self._toggle_secret(self.api_key_entry, self.btn_toggle_key))
         self.btn_toggle_key.grid(row=2, column=2, padx=2, pady=(5, 0))
 
         # Row 3: 模型选择 + 获取模型列表按钮
@@ -708,21 +2930,42 @@ class TranslationToolApp:
         ttk.Spinbox(temp_frame, from_=0.0, to=2.0, increment=0.1, textvariable=self.temperature_var, width=8, format='%.1f').pack(side='left')
         ttk.Label(temp_frame, text='(部分模型仅支持特定值，具体请查询服务商文档)', foreground='gray').pack(side='left', padx=10)
 
-        # Row 5: 线程数 + 跳过已翻译
-        ttk.Label(config, text="并发线程:").grid(row=5, column=0, sticky='w', pady=(5, 0))
+        # Row 5: 并发数 + 跳过已翻译
+        ttk.Label(config, text="并发上限:").grid(row=5, column=0, sticky='w', pady=(5, 0))
         opt_frame = ttk.Frame(config)
         opt_frame.grid(row=5, column=1, columnspan=2, sticky='we', padx=5, pady=(5, 0))
-        self.threads_var = tk.StringVar(value='3')
-        ttk.Spinbox(opt_frame, from_=1, to=50, textvariable=self.threads_var, width=8).pack(side='left')
-        ttk.Label(opt_frame, text="批量大小:").pack(side='left', padx=(15, 0))
-        self.batch_size_var = tk.StringVar(value='10')
-        ttk.Spinbox(opt_frame, from_=1, to=50, textvariable=self.batch_size_var, width=8).pack(side='left', padx=(5, 0))
+        self.threads_var = tk.StringVar(value='32')
+        ttk.Spinbox(opt_frame, from_=1, to=500, textvariable=self.threads_var, width=8).pack(side='left')
+        ttk.Label(opt_frame, text="单批上限:").pack(side='left', padx=(15, 0))
+        self.batch_size_var = tk.StringVar(value='40')
+        ttk.Spinbox(opt_frame, from_=1, to=200, textvariable=self.batch_size_var, width=8).pack(side='left', padx=(5, 0))
         ttk.Label(opt_frame, text="翻译模式:").pack(side='left', padx=(15, 0))
         self.translate_mode_var = tk.StringVar(value='添加（跳过已翻译）')
         mode_combo = ttk.Combobox(opt_frame, textvariable=self.translate_mode_var, state='readonly', width=20)
         mode_combo['values'] = ['添加（跳过已翻译）', '覆盖（重翻所有）']
         mode_combo.pack(side='left', padx=(5, 0))
 
+        # Row 6: 备用线路（与上面的主线路一起分担请求，某条线路变慢或出错时自动转移）
+        ttk.Label(config, text="备用线路:").grid(row=6, column=0, sticky='nw', pady=(5, 0))
+        routes_frame = ttk.Frame(config)
+        routes_frame.grid(row=6, column=1, columnspan=2, sticky='we', padx=5, pady=(5, 0))
+        self.routes_text = tk.Text(routes_frame, height=3, wrap='none')
+        self.routes_text.pack(fill='x')
+        ttk.Label(routes_frame, text='每行一条: 供应商名称或API地址 | 模型；并发上限按每个密钥计',
+                  foreground='gray').pack(anchor='w')
+
+        # Row 7: 备用线路的密钥（与主密钥一样隐藏显示）
+        ttk.Label(config, text="备用线路密钥:").grid(row=7, column=0, sticky='w', pady=(5, 0))
+        self.route_keys_var = tk.StringVar()
+        self.route_keys_entry = ttk.Entry(config, textvariable=self.route_keys_var, width=50, show='*')
+        self.route_keys_entry.grid(row=7, column=1, sticky='we', padx=5, pady=(5, 0))
+        self.btn_toggle_route_keys = ttk.Button(
+            config, text="显示", width=6,
+            command=lambda: self._toggle_secret(self.route_keys_entry, self.btn_toggle_route_keys))
+        self.btn_toggle_route_keys.grid(row=7, column=2, padx=2, pady=(5, 0))
+        ttk.Label(config, text='按备用线路顺序用 | 分隔，每条线路可填多个密钥(逗号分隔)，留空沿用上面的API密钥',
+                  foreground='gray').grid(row=8, column=1, columnspan=2, sticky='w', padx=5)
+
         config.columnconfigure(1, weight=1)
 
         # 翻译提示词（可编辑）
@@ -814,6 +3057,16 @@ class TranslationToolApp:
         self.wrap_width_var = tk.StringVar(value='15')
         ttk.Spinbox(trans_frame, from_=0, to=50, textvariable=self.wrap_width_var, width=6).grid(row=0, column=1, sticky='w', padx=5)
         ttk.Label(trans_frame, text="(0=不换行，根据需要合理设置)", foreground='gray').grid(row=0, column=2, sticky='w')
+        self.normalize_punct_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(trans_frame, text="中文后的半角标点转为全角（, ! ? ; :）",
+                        variable=self.normalize_punct_var).grid(row=1, column=0, columnspan=3, sticky='w', pady=(5, 0))
+        ttk.Label(trans_frame, text="同时输出到:").grid(row=2, column=0, sticky='w', pady=(5, 0))
+        self.extra_target_choices = ['无']
+        self.extra_target_choices += [f"{code} ({name}，写入中文)" for code, name in OVERRIDE_LANGUAGES]
+        self.extra_target_choices.append(f"{TC_TARGET_LANG} (繁体中文，需 {S2T_TABLE_NAME})")
+        self.extra_target_var = tk.StringVar(value='无')
+        ttk.Combobox(trans_frame, textvariable=self.extra_target_var, values=self.extra_target_choices,
+                     state='readonly', width=32).grid(row=2, column=1, columnspan=2, sticky='w', padx=5, pady=(5, 0))
 
         # 字体选择
         font_frame = ttk.LabelFrame(tab, text="字体设置", padding=10)
@@ -856,6 +3109,7 @@ class TranslationToolApp:
         ttk.Button(btn_frame, text="🔧 应用补丁（CSV→游戏）", command=self._apply_patch).pack(side='left', padx=10)
         ttk.Button(btn_frame, text="🔄 还原补丁", command=self._restore_patch).pack(side='left', padx=10)
         ttk.Button(btn_frame, text="🛠 修复游戏语言配置", command=self._fix_game_language).pack(side='left', padx=10)
+        ttk.Button(btn_frame, text="📏 检查换行", command=self._lint_wrap).pack(side='left', padx=10)
 
         # 补丁进度
         self.patch_progress_var = tk.DoubleVar(value=0)
@@ -901,15 +3155,17 @@ class TranslationToolApp:
 
         def do_read():
             try:
-                all_data, entries, data_start = extract_all_languages(read_path)
+                # 只读索引和原始字节，各CSV在首次使用时才解析
+                all_data, entries, data_start = open_corpus(read_path)
                 self.all_data = all_data
                 self.entries = entries
                 self.data_start = data_start
 
-                # 自动导出CSV并从中加载已有翻译
+                # 缺失的CSV后台导出；已有翻译只从用户改动过的CSV重读
                 csv_dir = self._get_csv_dir()
-                self._export_csvs_to_dir(read_path, entries, data_start, csv_dir)
-                self._load_translations_from_csvs(csv_dir)
+                self._sync_csv_dir(csv_dir)
+                # 重放并合并上次未合并的翻译日志（崩溃恢复）
+                self._recover_journal()
 
                 self.root.after(0, self._on_gpak_loaded)
             except Exception as e:
@@ -920,9 +3176,12 @@ class TranslationToolApp:
         threading.Thread(target=do_read, daemon=True).start()
 
     def _count_translatable(self, csv_name):
-        """统计某CSV中可翻译条数（英文非空的行）"""
-        csv_data = self.all_data.get(csv_name, {})
-        return sum(1 for langs in csv_data.values() if langs.get('en', ''))
+        """统计某CSV中可翻译条数（英文非空的行）；未解析的文件返回估算行数"""
+        if csv_name not in self.all_data:
+            return 0
+        if isinstance(self.all_data, LazyCorpus) and not self.all_data.is_loaded(csv_name):
+            return self.all_data.row_counts.get(csv_name, 0)
+        return self.all_data[csv_name].count_nonempty('en')
 
     def _on_gpak_loaded(self):
         """GPAK读取完成回调"""
@@ -980,79 +3239,157 @@ class TranslationToolApp:
             d = self.csv_dir_var.get().strip()
             os.makedirs(d, exist_ok=True)
             return d
-        # 默认：程序当前路径下的csv_export
-        if getattr(sys, 'frozen', False):
-            d = os.path.join(os.path.dirname(sys.executable), 'csv_export')
-        else:
-            d = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv_export')
+        d = self._default_csv_dir()
         os.makedirs(d, exist_ok=True)
         # 同步到补丁tab的目录设置
         if hasattr(self, 'csv_dir_var'):
             self.csv_dir_var.set(d)
         return d
 
-    def _export_csvs_to_dir(self, gpak_path, entries, data_start, csv_dir):
-        """从GPAK导出所有CSV到指定目录（如果目录中已有同名文件则跳过）"""
-        os.makedirs(csv_dir, exist_ok=True)
-        for entry in entries:
-            name = entry['name']
-            if not name.startswith('data/text/') or not name.endswith('.csv'):
+    def _default_csv_dir(self):
+        """默认CSV目录：程序当前路径下的csv_export"""
+        if getattr(sys, 'frozen', False):
+            return os.path.join(os.path.dirname(sys.executable), 'csv_export')
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'csv_export')
+
+    def _read_export_manifest(self, csv_dir):
+        """读取CSV导出记录 {csv_name: {sha1, mtime_ns, size}}"""
+        path = os.path.join(csv_dir, EXPORT_MANIFEST_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            return manifest if isinstance(manifest, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _sync_csv_dir(self, csv_dir):
+        """读取GPAK后同步CSV目录（每个CSV只解析一次）
+
+        - 目录中没有的CSV：用已读取的原始字节在后台线程导出
+        - 与上次导出完全一致的CSV（mtime/大小/游戏数据哈希都相同）：不重读，
+          已有翻译直接取自内存中的游戏数据
+        - 用户改动过或来自旧版本游戏的CSV：重读一次以加载其中的翻译
+        """
+        manifest = self._read_export_manifest(csv_dir)
+        to_export = {}
+        from_game = []
+        for csv_name in self.all_data:
+            raw = self.all_data.raw(csv_name)
+            csv_path = os.path.join(csv_dir, csv_name)
+            if not os.path.isfile(csv_path):
+                to_export[csv_name] = raw
+                from_game.append(csv_name)
                 continue
-            csv_name = os.path.basename(name)
+            st = os.stat(csv_path)
+            entry = manifest.get(csv_name) or {}
+            if (entry.get('mtime_ns') == st.st_mtime_ns and entry.get('size') == st.st_size
+                    and entry.get('sha1') == hashlib.sha1(raw).hexdigest()):
+                from_game.append(csv_name)
+                self._csv_read_stamps[csv_path] = (st.st_mtime_ns, st.st_size)
+            else:
+                self._load_translations_from_csv(csv_path, csv_name)
+
+        # 与游戏数据一致的文件：只读KEY列和schinese列取出已有翻译，整表等打开或打补丁时才解析
+        for csv_name in from_game:
+            trans = translations_from_csv(self.all_data.raw(csv_name))
+            if trans:
+                trans.update(self.translations.get(csv_name, {}))
+                self.translations[csv_name] = trans
+
+        if to_export:
+            self._export_thread = threading.Thread(
+                target=self._export_csvs_to_dir, args=(to_export, csv_dir), daemon=True)
+            self._export_thread.start()
+
+    def _export_csvs_to_dir(self, raw_files, csv_dir):
+        """把已提取的CSV原始字节写入目录并更新导出记录（后台线程）"""
+        os.makedirs(csv_dir, exist_ok=True)
+        exported = {}
+        for csv_name, raw_bytes in raw_files.items():
             out_path = os.path.join(csv_dir, csv_name)
             if os.path.isfile(out_path):
                 continue  # 已存在则不覆盖（保留用户修改）
-            raw_bytes = extract_file_from_gpak(gpak_path, entries, data_start, name)
-            if raw_bytes:
-                with open(out_path, 'wb') as f:
+            try:
+                tmp = out_path + '.tmp'
+                with open(tmp, 'wb') as f:
                     f.write(raw_bytes)
+                os.replace(tmp, out_path)
+            except OSError:
+                continue
+            st = os.stat(out_path)
+            exported[csv_name] = {'sha1': hashlib.sha1(raw_bytes).hexdigest(),
+                                  'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+            self._csv_read_stamps[out_path] = (st.st_mtime_ns, st.st_size)
+        if exported:
+            manifest = self._read_export_manifest(csv_dir)
+            manifest.update(exported)
+            try:
+                _write_json_atomic(os.path.join(csv_dir, EXPORT_MANIFEST_NAME), manifest)
+            except OSError:
+                pass
+        self._ui.post(self._on_export_done)
+
+    def _on_export_done(self):
+        """后台导出完成（主线程）：刷新补丁页并执行排队等待导出的操作"""
+        self._refresh_patch_files()
+        pending, self._after_export = self._after_export, []
+        for fn in pending:
+            fn()
+
+    def _defer_until_exported(self, fn, status="CSV导出尚未完成，完成后自动继续..."):
+        """主线程中要写CSV的操作：导出仍在进行时排到导出完成后再执行，返回是否已推迟
+
+        主线程不能 join 导出线程：导出线程结束时要回到主线程刷新界面。
+        """
+        t = self._export_thread
+        if t is None or not t.is_alive():
+            return False
+        if fn not in self._after_export:
+            self._after_export.append(fn)
+        self.status_var.set(status)
+        return True
+
+    def _wait_for_export(self):
+        """等待后台导出完成（写CSV前调用，仅限后台线程；主线程用 _defer_until_exported）"""
+        t = self._export_thread
+        if t is not None and t.is_alive() and t is not threading.current_thread():
+            t.join()
 
     def _load_translations_from_csvs(self, csv_dir):
-        """从SV文件中加载已有的中文翻译（检测schinese列中的中文字符）"""
+        """从CSV文件中加载已有的中文翻译（只重读上次读取后有变化的文件）"""
         if not os.path.isdir(csv_dir):
             return
         for fname in os.listdir(csv_dir):
             if not fname.endswith('.csv'):
                 continue
-            csv_path = os.path.join(csv_dir, fname)
-            try:
-                with open(csv_path, 'rb') as f:
-                    raw = f.read()
-                data = raw.lstrip(b'\xef\xbb\xbf').decode('utf-8')
-                rows = split_csv_logical_rows(data)
-                if not rows:
-                    continue
-                header_fields = split_csv_fields(rows[0].rstrip('\r\n'))
-                target_col = -1
-                for idx, field in enumerate(header_fields):
-                    if field.strip().lower() == CN_TARGET_LANG:
-                        target_col = idx
-                        break
-                if target_col < 0:
-                    continue
-                trans = {}
-                for row in rows[1:]:
-                    stripped = row.rstrip('\r\n').strip()
-                    if not stripped or stripped.startswith('//'):
-                        continue
-                    key = get_first_field(stripped)
-                    if not key:
-                        continue
-                    fields = split_csv_fields(stripped)
-                    if target_col < len(fields):
-                        val = unquote_csv_field(fields[target_col]).strip()
-                        # 受保护的key使用固定值
-                        if key in PROTECTED_KEYS:
-                            trans[key] = PROTECTED_KEYS[key]
-                        elif val:
-                            trans[key] = val
-                if trans:
-                    # 合并：CSV数据为基础，内存中已有的翻译优先保留
-                    existing = self.translations.get(fname, {})
-                    trans.update(existing)
-                    self.translations[fname] = trans
-            except Exception:
-                continue
+            self._load_translations_from_csv(os.path.join(csv_dir, fname), fname)
+
+    def _load_translations_from_csv(self, csv_path, fname):
+        """从单个CSV文件加载schinese列翻译（检测schinese列中的中文字符）"""
+        try:
+            st = os.stat(csv_path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            if self._csv_read_stamps.get(csv_path) == stamp:
+                return
+            with open(csv_path, 'rb') as f:
+                raw = f.read()
+            self._csv_read_stamps[csv_path] = stamp
+            trans = translations_from_csv(raw)
+            if trans:
+                # 合并：CSV数据为基础，内存中已有的翻译优先保留
+                existing = self.translations.get(fname, {})
+                trans.update(existing)
+                self.translations[fname] = trans
+        except Exception:
+            pass
+
+    def _mark_csv_written(self, csv_path):
+        """记录程序自己写入的CSV状态，避免随后被当作用户修改而重读"""
+        try:
+            st = os.stat(csv_path)
+            self._csv_read_stamps[csv_path] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            pass
 
     def _on_file_selected(self, event):
         """文件下拉框选择变更"""
@@ -1077,10 +3414,10 @@ class TranslationToolApp:
         total = 0
         translated = 0
         row_no = 0
-        for key, langs in csv_data.items():
-            en = langs.get('en', '')
+        rows = zip(csv_data.keys_list, csv_data.column('en'), csv_data.column(CN_TARGET_LANG))
+        for key, en, game_cn in rows:
             # 优先从all_data的schinese列获取，其次从translations获取
-            cn = langs.get(CN_TARGET_LANG, '') or cn_data.get(key, '')
+            cn = game_cn or cn_data.get(key, '')
             # 英文为空的行不计入统计，也不算未翻译
             if not en.strip():
                 if self.untranslated_only_var.get():
@@ -1122,11 +3459,12 @@ class TranslationToolApp:
         if not values:
             return
         key = values[1]
-        csv_data = self.all_data.get(self.current_file, {})
-        langs = csv_data.get(key, {})
-        en = langs.get('en', '')
+        csv_data = self.all_data.get(self.current_file)
+        if csv_data is None:
+            return
+        en = csv_data.get_text(key, 'en')
         # 优先从all_data的schinese列获取，其次从translations获取
-        cn = langs.get(CN_TARGET_LANG, '') or self.translations.get(self.current_file, {}).get(key, '')
+        cn = csv_data.get_text(key, CN_TARGET_LANG) or self.translations.get(self.current_file, {}).get(key, '')
 
         self.edit_key_var.set(key)
         self.edit_en_var.set(en)
@@ -1152,35 +3490,114 @@ class TranslationToolApp:
             cn_display = cn_text.replace('\n', '↵ ')[:200]
             self.tree.item(self._editing_item, values=(row_no, key, en_display, cn_display))
 
-        # 直接写入CSV文件
-        self._auto_save_translations(self.current_file)
+        # 直接写入CSV文件；导出仍在进行时排到导出完成后写入，主线程不等待导出线程
+        self._unsaved_edits.add(self.current_file)
+        if self._defer_until_exported(self._flush_edits, "CSV导出尚未完成，完成后自动写入编辑..."):
+            return
+        self._flush_edits()
         csv_dir = self._get_csv_dir()
         self.status_var.set(f"已保存: {key} → {os.path.join(csv_dir, self.current_file)}")
 
+    def _flush_edits(self):
+        """把手动编辑过的文件写回CSV（主线程，确认没有导出在进行后调用）"""
+        pending, self._unsaved_edits = self._unsaved_edits, set()
+        for csv_name in sorted(pending):
+            self._auto_save_translations(csv_name)
+        self.status_var.set(f"已保存编辑到 {len(pending)} 个CSV文件")
+
+    def _patch_targets(self, pipeline, wrap_width, log):
+        """打补丁写入的列 [(列名, RowPipeline)]：schinese，加上用户选择的额外输出列"""
+        targets = [(CN_TARGET_LANG, pipeline)]
+        choice = self.extra_target_var.get() if hasattr(self, 'extra_target_var') else '无'
+        code = choice.split(' ', 1)[0]
+        if code in dict(OVERRIDE_LANGUAGES):
+            targets.append((code, pipeline))
+        elif code == TC_TARGET_LANG:
+            if getattr(sys, 'frozen', False):
+                base_dir = os.path.dirname(sys.executable)
+            else:
+                base_dir = os.path.dirname(os.path.abspath(__file__))
+            table_path = os.path.join(base_dir, S2T_TABLE_NAME)
+            if not os.path.isfile(table_path):
+                log(f"  ⚠ 未找到简繁字表 {table_path}，跳过繁体输出")
+                return targets
+            table = load_s2t_table(table_path)
+            targets.append((TC_TARGET_LANG, self._patch_pipeline(wrap_width, s2t_table=table)))
+        if len(targets) > 1:
+            log(f"  输出列: {', '.join(lang for lang, _ in targets)}")
+        return targets
+
+    def _patch_pipeline(self, wrap_width, s2t_table=None):
+        """保存与打补丁共用的流水线：阶段相同则缓存标记相同，保存后再打补丁可直接命中换行缓存"""
+        return patch_pipeline(wrap_width, strip_newlines=True, normalize_punct=self._normalize_punct(),
+                              s2t_table=s2t_table)
+
+    def _normalize_punct(self):
+        """是否在写入CSV时把中文后的半角标点换成全角"""
+        return bool(self.normalize_punct_var.get()) if hasattr(self, 'normalize_punct_var') else False
+
+    def _ensure_char_widths(self, log=None):
+        """按当前字体设置加载换行用的字符宽度表（读取失败时按字符类型估算）"""
+        font_path = self.font_path_var.get().strip() if hasattr(self, 'font_path_var') else ''
+        swf_path = self.font_swf_var.get().strip() if hasattr(self, 'font_swf_var') else ''
+        game_dir = self.game_dir_var.get().strip() if hasattr(self, 'game_dir_var') else ''
+        gpak_path = os.path.join(game_dir, 'resources.gpak') if game_dir else ''
+        try:
+            table = load_char_widths(font_path, swf_path, gpak_path, self._get_csv_dir())
+        except Exception as e:
+            table = None
+            if log:
+                log(f"  读取字体宽度失败: {e}")
+        set_char_widths(table)
+        if log:
+            log(f"  字符宽度: {table.source if table else '按字符类型估算'}")
+
     def _save_all(self):
-        """保存所有翻译到CSV文件（schinese列）"""
+        """保存所有翻译到CSV文件（schinese列）；加载字体宽度和写文件在后台线程进行"""
         if not self.translations:
             messagebox.showwarning("提示", "没有可保存的翻译")
             return
+        if self._defer_until_exported(self._save_all, "CSV导出尚未完成，完成后自动保存..."):
+            return
+        if self._save_running:
+            return
         csv_dir = self._get_csv_dir()
-        wrap_chars = int(self.wrap_width_var.get()) if hasattr(self, 'wrap_width_var') else 10
+        wrap_chars = int(self.wrap_width_var.get()) if hasattr(self, 'wrap_width_var') else 15
         wrap_width = wrap_chars * 2 if wrap_chars > 0 else None
-        count = 0
-        total_trans = 0
-        for csv_name, trans in self.translations.items():
-            if not trans:
-                continue
-            csv_path = os.path.join(csv_dir, csv_name)
-            if not os.path.isfile(csv_path):
-                continue
-            with open(csv_path, 'rb') as f:
-                raw_bytes = f.read()
-            patched_bytes, trans_count = patch_csv_bytes(raw_bytes, trans, CN_TARGET_LANG, wrap_width)
-            with open(csv_path, 'wb') as f:
-                f.write(patched_bytes)
-            count += 1
-            total_trans += trans_count
-        self.status_var.set(f"已保存 {total_trans} 条翻译到 {count} 个CSV文件 ({csv_dir})")
+        pipeline = self._patch_pipeline(wrap_width)
+        translations = {csv_name: dict(trans) for csv_name, trans in self.translations.items() if trans}
+        self._save_running = True
+        self.status_var.set("正在保存翻译...")
+
+        def worker():
+            try:
+                # 只有换行时才需要字符宽度表（冷缓存时要读GPAK并解析字体）
+                if wrap_width is not None:
+                    self._ensure_char_widths()
+                count = 0
+                total_trans = 0
+                for csv_name, trans in translations.items():
+                    csv_path = os.path.join(csv_dir, csv_name)
+                    if not os.path.isfile(csv_path):
+                        continue
+                    with open(csv_path, 'rb') as f:
+                        raw_bytes = f.read()
+                    patched_bytes, trans_count = patch_csv_bytes(raw_bytes, trans, CN_TARGET_LANG,
+                                                                 wrap_cache=WRAP_CACHE, pipeline=pipeline)
+                    with open(csv_path, 'wb') as f:
+                        f.write(patched_bytes)
+                    self._mark_csv_written(csv_path)
+                    count += 1
+                    total_trans += trans_count
+                hits, misses = WRAP_CACHE.take_stats()
+                self._ui.post(self.status_var.set, f"已保存 {total_trans} 条翻译到 {count} 个CSV文件 ({csv_dir})，"
+                                                   f"重新换行 {misses} 条（缓存命中 {hits}）")
+            except Exception as e:
+                self._ui.post(self.status_var.set, f"保存失败: {e}")
+            finally:
+                self._save_running = False
+
+        threading.Thread(target=worker, daemon=True).start()
 
     # ==================== Tab2 AI翻译 ====================
 
@@ -1198,27 +3615,27 @@ class TranslationToolApp:
                     self.base_url_entry.configure(state='normal')
                 break
 
-    def _toggle_api_key(self):
-        """切换API密钥显示/隐藏"""
-        if self.api_key_entry.cget('show') == '*':
-            self.api_key_entry.configure(show='')
-            self.btn_toggle_key.configure(text='隐藏')
+    def _toggle_secret(self, entry, button):
+        """切换密钥输入框的显示/隐藏"""
+        if entry.cget('show') == '*':
+            entry.configure(show='')
+            button.configure(text='隐藏')
         else:
-            self.api_key_entry.configure(show='*')
-            self.btn_toggle_key.configure(text='显示')
+            entry.configure(show='*')
+            button.configure(text='显示')
 
     def _create_client(self):
         """创建OpenAI兼容客户端"""
         import httpx
         from openai import OpenAI
-        api_key = self.api_key_var.get().strip()
+        api_keys = split_api_keys(self.api_key_var.get())
         base_url = self.base_url_var.get().strip()
-        if not api_key:
+        if not api_keys:
             raise ValueError("请输入API密钥")
         if not base_url:
             raise ValueError("请输入API地址")
         return OpenAI(
-            api_key=api_key, base_url=base_url,
+            api_key=api_keys[0], base_url=base_url,
             http_client=httpx.Client(
                 limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
                 timeout=httpx.Timeout(120.0, connect=30.0),
@@ -1226,22 +3643,23 @@ class TranslationToolApp:
         )
 
     def _get_client_config(self):
-        """获取客户端配置参数（用于多线程各自创建独立client）"""
-        api_key = self.api_key_var.get().strip()
+        """获取客户端配置参数（翻译线程据此为每个密钥创建自己的异步client）"""
+        api_keys = split_api_keys(self.api_key_var.get())
         base_url = self.base_url_var.get().strip()
-        if not api_key:
+        if not api_keys:
             raise ValueError("请输入API密钥")
         if not base_url:
             raise ValueError("请输入API地址")
-        return {'api_key': api_key, 'base_url': base_url}
+        return {'api_keys': api_keys, 'base_url': base_url}
 
-    def _create_thread_client(self, config):
-        """为当前线程创建独立的OpenAI客户端"""
+    def _create_async_client(self, config, concurrency):
+        """创建异步客户端：所有在途请求共用一个连接池"""
         import httpx
-        from openai import OpenAI
-        return OpenAI(
+        from openai import AsyncOpenAI
+        return AsyncOpenAI(
             api_key=config['api_key'], base_url=config['base_url'],
-            http_client=httpx.Client(
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
                 timeout=httpx.Timeout(120.0, connect=30.0),
             ),
         )
@@ -1285,9 +3703,9 @@ class TranslationToolApp:
             self.translate_log.insert('end', msg + '\n')
             self.translate_log.see('end')
             self.translate_log.configure(state='disabled')
-        self.root.after(0, _do)
+        self._ui.post(_do)
 
-    def _update_token_stats(self, prompt_tokens=0, completion_tokens=0):
+    def _update_token_stats(self, prompt_tokens=0, completion_tokens=0, glossary_saved=0, cached_tokens=0):
         """更新Token统计（线程安全）"""
         if not hasattr(self, '_token_lock'):
             self._token_lock = threading.Lock()
@@ -1295,8 +3713,18 @@ class TranslationToolApp:
             self.total_prompt_tokens += prompt_tokens
             self.total_completion_tokens += completion_tokens
             self.total_tokens = self.total_prompt_tokens + self.total_completion_tokens
+            self.glossary_saved_tokens += glossary_saved
+            self.cached_prompt_tokens += cached_tokens
         text = f"Token用量: 输入 {self.total_prompt_tokens:,} | 输出 {self.total_completion_tokens:,} | 合计 {self.total_tokens:,}"
-        self.root.after(0, lambda: self.token_stats_var.set(text))
+        if self.cached_prompt_tokens:
+            rate = self.cached_prompt_tokens / max(1, self.total_prompt_tokens)
+            text += f" | 缓存命中 {self.cached_prompt_tokens:,} ({rate:.0%})"
+        if self.glossary_saved_tokens:
+            text += f" | 术语表按需注入节省≈{self.glossary_saved_tokens:,}"
+        limiter = self._limiter
+        if limiter is not None:
+            text += f" | 并发: {limiter.current}/{limiter.max_limit}"
+        self._ui.post(self.token_stats_var.set, text)
 
     def _start_translate(self):
         """开始AI翻译"""
@@ -1305,9 +3733,7 @@ class TranslationToolApp:
             return
         try:
             client_config = self._get_client_config()
-            # 验证配置有效（创建一个测试client）
-            test_client = self._create_thread_client(client_config)
-            del test_client
+            extra_routes = parse_route_lines(self.routes_text.get('1.0', 'end'), self.route_keys_var.get())
         except Exception as e:
             messagebox.showwarning("配置错误", str(e))
             return
@@ -1316,8 +3742,18 @@ class TranslationToolApp:
         if not model:
             messagebox.showwarning("提示", "请选择或输入模型名称")
             return
-
-        threads = int(self.threads_var.get())
+        provider_name = self.provider_var.get()
+        # 主线路在前，备用线路的空密钥沿用主线路的密钥；每个密钥展开为一条线路
+        routes = []
+        for spec in [dict(client_config, provider=provider_name, model=model)] + extra_routes:
+            keys = spec.pop('api_keys') or client_config['api_keys']
+            for i, api_key in enumerate(keys):
+                label = f"{spec['provider']}/{spec['model']}"
+                if len(keys) > 1:
+                    label += f" 密钥{i + 1}"
+                routes.append(dict(spec, api_key=api_key, name=label))
+
+        concurrency = int(self.threads_var.get())
         batch_size = int(self.batch_size_var.get())
         # 翻译模式：添加=跳过已翻译，覆盖=重翻所有
         skip_existing = '添加' in self.translate_mode_var.get()
@@ -1329,9 +3765,12 @@ class TranslationToolApp:
             return
 
         # 重置token统计
+        self._limiter = None
         self.total_prompt_tokens = 0
         self.total_completion_tokens = 0
         self.total_tokens = 0
+        self.glossary_saved_tokens = 0
+        self.cached_prompt_tokens = 0
         self._update_token_stats()
 
         # 重置进度条
@@ -1351,347 +3790,552 @@ class TranslationToolApp:
             messagebox.showwarning("提示", "翻译提示词不能为空")
             return
 
-        provider_name = self.provider_var.get()
         mode_text = '添加' if skip_existing else '覆盖'
-        self._log_translate(f"供应商: {provider_name} | 模型: {model} | 温度: {temperature} | 线程: {threads} | 批量: {batch_size} | 模式: {mode_text}")
+        self._log_translate(f"供应商: {provider_name} | 模型: {model} | 温度: {temperature} | 并发: {concurrency} | 单批上限: {batch_size}条 | 模式: {mode_text}")
+        if len(routes) > 1:
+            self._log_translate(f"线路: {len(routes)} 条（备用线路 {len(extra_routes)} 条，含多密钥展开），"
+                                f"按实测吞吐、延迟和错误率分配请求")
 
         # 翻译状态对象（传参用，避免闭包）
+        # models 是各线路用到的模型（主模型在前）：译文按实际出译文的模型记入翻译记忆，查找时都认
         ctx = {
-            'client_config': client_config, 'model': model, 'temperature': temperature,
-            'sys_prompt': user_prompt, 'batch_size': batch_size,
+            'routes': routes, 'model': model, 'models': list(dict.fromkeys(r['model'] for r in routes)),
+            'temperature': temperature,
+            'sys_prompt': user_prompt, 'batch_size': batch_size, 'concurrency': concurrency,
+            # 日志和翻译记忆在主线程按当前CSV目录解析好，事件循环线程不读取界面变量
+            'journal': self._get_journal(), 'tm': self._get_translation_memory(),
         }
-        # 线程本地存储：每个线程独立的client
-        self._thread_local = threading.local()
 
         def worker():
-            from concurrent.futures import ThreadPoolExecutor, as_completed
-            total_done = 0
-            total_err = 0
-            total_skip = 0
+            # 整个翻译任务跑在这个后台线程的事件循环里，Tk主线程只接收消息
+            try:
+                asyncio.run(self._translate_files_async(ctx, selected_files, skip_existing))
+            except Exception as e:
+                self._log_translate(f"[错误] 翻译中断: {e}")
+            self._ui.post(self._on_translate_done)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    async def _translate_files_async(self, ctx, selected_files, skip_existing):
+        """异步翻译主流程：一个事件循环 + 一个连接池，所有文件的批次进入同一个全局队列"""
+        total_skip = 0
+
+        # 解析本次要翻译的文件（未加载的批量并行解析）
+        if isinstance(self.all_data, LazyCorpus):
+            self.all_data.load(selected_files)
+
+        # 预先计算所有文件的总待翻译数
+        grand_total = 0
+        for csv_name in selected_files:
+            if csv_name not in self.all_data:
+                continue
+            csv_data = self.all_data[csv_name]
+            cn_data = self.translations.get(csv_name, {})
+            for key, langs in csv_data.items():
+                en = langs.get('en', '')
+                if not en:
+                    continue
+                if skip_existing and key in cn_data and cn_data[key]:
+                    continue
+                grand_total += 1
+        progress = {'global_done': 0, 'grand_total': grand_total}
+        self._log_translate(f"总计待翻译: {grand_total} 条")
+
+        concurrency = ctx['concurrency']
+        batch_size = ctx['batch_size']
+        # 每条线路（每个密钥）一个连接池；并发上限由各线路的AIMD控制器在 [1, 用户设定] 之间自动调整，
+        # RPM/TPM限速器按(供应商, 模型, 密钥)共享，发送前等待额度而不是靠429试探
+        routes = []
+        for spec in ctx['routes']:
+            routes.append({
+                'name': spec['name'], 'model': spec['model'],
+                'client': self._create_async_client(spec, concurrency),
+                'rate': rate_limiter_for(spec['provider'], spec['base_url'], spec['model'], spec['api_key']),
+                'limiter': AdaptiveLimiter(concurrency),
+            })
+            self._log_translate(f"速率限制 [{routes[-1]['name']}]: {routes[-1]['rate'].describe()}")
+        ctx['limiter'] = self._limiter = RouteBalancer(routes)
+        self._update_token_stats()
+        journal = ctx['journal']
+
+        # 相同原文（跨key、跨文件）只翻译一次，译文分发给所有key；翻译记忆里已有的直接套用
+        tm = ctx['tm']
+        tm.load()
+        ctx.update({
+            'progress': progress, 'job_start': time.time(),
+            'prompt_hash': prompt_hash(ctx['sys_prompt']), 'units': {},
+            'mask_saved': 0,
+            # 覆盖模式要求全部重新请求：不套用翻译记忆和模糊匹配（新结果照常写入翻译记忆）
+            'reuse_memory': skip_existing,
+        })
+        # 术语表不再随每批完整发送：从提示词中拆出，每批只注入实际出现的条目
+        ctx['sys_prompt'], glossary = split_glossary(ctx['sys_prompt'])
+        # 固定要求并入系统消息，保证每批请求的前缀完全一致（便于服务端前缀缓存）
+        ctx['sys_prompt'] = f"{ctx['sys_prompt'].rstrip()}\n\n{BATCH_INSTRUCTION}"
+        ctx['glossary'] = GlossaryMatcher(glossary) if glossary else None
+        ctx['glossary_tokens'] = estimate_tokens(format_glossary(glossary)) if glossary else 0
+        if glossary:
+            self._log_translate(f"术语表: {len(glossary)} 条，按批注入实际出现的术语")
+        ctx['fuzzy'] = tm.fuzzy_index(ctx['prompt_hash'], ctx['models'])
+        self._log_translate(f"翻译记忆: {len(tm)} 条，模糊匹配索引 {len(ctx['fuzzy'])} 条")
+        units = ctx['units']
+        by_source = {}
+
+        async def run_batch(label, batch):
+            if self.translate_stop_event.is_set():
+                return
+            try:
+                await self._do_translate_batch(ctx, label, batch)
+            except Exception as e:
+                self._log_translate(f"  [批{label}] 异常: {e}")
+                for key, _ in batch:
+                    self._resolve_unit(ctx, units[key], None)
 
-            # 预先计算所有文件的总待翻译数
-            grand_total = 0
+        files = []
+        tasks = []
+        watcher = None
+        try:
+            # 先汇总所有文件的待译条目，再把全部批次放进同一个队列：
+            # 上一个文件的收尾批次与下一个文件的批次同时在途，并发名额不会在文件之间空转
             for csv_name in selected_files:
                 if csv_name not in self.all_data:
                     continue
                 csv_data = self.all_data[csv_name]
                 cn_data = self.translations.get(csv_name, {})
+
+                to_translate = {}
                 for key, langs in csv_data.items():
                     en = langs.get('en', '')
                     if not en:
                         continue
-                    if skip_existing and key in cn_data and cn_data[key]:
-                        continue
-                    grand_total += 1
-            global_done = [0]
-
-            def _update_total_progress():
-                """更新总进度条"""
-                if grand_total > 0:
-                    pct = global_done[0] / grand_total * 100
-                    self.root.after(0, lambda p=pct: self.translate_total_progress_var.set(p))
-                    self.root.after(0, lambda p=pct, d=global_done[0], t=grand_total: self.translate_total_pct_var.set(f"{d}/{t} ({p:.0f}%)"))
-
-            self._log_translate(f"总计待翻译: {grand_total} 条")
-
-            # 创建全局线程池（复用，而非每个文件创建一个）
-            executor = ThreadPoolExecutor(max_workers=threads)
-
-            try:
-                for csv_name in selected_files:
-                    if self.translate_stop_event.is_set():
-                        break
-                    if csv_name not in self.all_data:
+                    # 受保护的key使用固定值，不交给AI翻译
+                    if key in PROTECTED_KEYS:
+                        if csv_name not in self.translations:
+                            self.translations[csv_name] = {}
+                        self.translations[csv_name][key] = PROTECTED_KEYS[key]
+                        total_skip += 1
                         continue
-                    csv_data = self.all_data[csv_name]
-                    cn_data = self.translations.get(csv_name, {})
-
-                    # 重置当前文件进度
-                    self.root.after(0, lambda: self.translate_progress_var.set(0))
-                    self.root.after(0, lambda n=csv_name: self.translate_pct_var.set(f"{n}"))
-
-                    to_translate = {}
-                    for key, langs in csv_data.items():
-                        en = langs.get('en', '')
-                        if not en:
-                            continue
-                        # 受保护的key使用固定值，不交给AI翻译
-                        if key in PROTECTED_KEYS:
-                            if csv_name not in self.translations:
-                                self.translations[csv_name] = {}
-                            self.translations[csv_name][key] = PROTECTED_KEYS[key]
-                            total_skip += 1
-                            continue
-                        if skip_existing and key in cn_data and cn_data[key]:
-                            total_skip += 1
-                            continue
-                        to_translate[key] = langs
-
-                    if not to_translate:
-                        self._log_translate(f"[跳过] {csv_name} - 全部已翻译")
+                    if skip_existing and key in cn_data and cn_data[key]:
+                        total_skip += 1
                         continue
+                    to_translate[key] = langs
 
-                    # 分批
-                    items = list(to_translate.items())
-                    batches = [items[i:i+batch_size] for i in range(0, len(items), batch_size)]
-                    file_total = len(items)
-                    self._log_translate(f"[开始] {csv_name}: {file_total} 条待翻译，分 {len(batches)} 批×{batch_size}条，{threads}线程并发")
-
-                    done_count = [0]
-                    err_count = [0]
-                    result_lock = threading.Lock()
-
-                    file_start_time = time.time()
-
-                    # 提交所有批次到线程池
-                    futures = []
-                    for batch_idx, batch in enumerate(batches):
-                        future = executor.submit(
-                            self._do_translate_batch,
-                            ctx, csv_name, batch_idx, len(batches), batch,
-                            done_count, err_count, result_lock, file_total,
-                            global_done,
-                        )
-                        futures.append(future)
-
-                    # 收集结果（基于时间间隔保存和刷新，减少I/O开销）
-                    last_save_time = time.time()
-                    last_refresh_time = time.time()
-                    for future in as_completed(futures):
-                        if self.translate_stop_event.is_set():
-                            break
-                        try:
-                            future.result()
-                        except Exception:
-                            pass
-                        # 更新进度条
-                        _update_total_progress()
-                        pct = done_count[0] / file_total * 100 if file_total else 100
-                        self.root.after(0, lambda p=pct: self.translate_progress_var.set(p))
-                        now = time.time()
-                        # 每30秒自动保存一次CSV
-                        if now - last_save_time >= 30:
-                            self._auto_save_translations(csv_name)
-                            last_save_time = now
-                        # 每5秒刷新一次表格
-                        if csv_name == self.current_file and now - last_refresh_time >= 5:
-                            self.root.after(0, self._refresh_table)
-                            last_refresh_time = now
-
-                    # 文件翻译完成后保存并刷新
-                    self._auto_save_translations(csv_name)
-                    if csv_name == self.current_file:
-                        self.root.after(0, self._refresh_table)
-                    total_done += done_count[0]
-                    total_err += err_count[0]
-                    elapsed = time.time() - file_start_time
-                    self._log_translate(f"[完成] {csv_name}: 成功 {done_count[0]}，失败 {err_count[0]}，耗时 {elapsed:.1f}s")
-            finally:
-                executor.shutdown(wait=False)
+                if not to_translate:
+                    self._log_translate(f"[跳过] {csv_name} - 全部已翻译")
+                    continue
 
-            self._log_translate(f"\n翻译结束！成功: {total_done}，跳过: {total_skip}，失败: {total_err}")
-            self._log_translate(f"Token总计: 输入 {self.total_prompt_tokens:,} | 输出 {self.total_completion_tokens:,} | 合计 {self.total_tokens:,}")
-            self.root.after(0, self._on_translate_done)
+                self._log_translate(f"[排队] {csv_name}: {len(to_translate)} 条待翻译")
+                state = {'name': csv_name, 'done': 0, 'err': 0, 'tm': 0, 'fuzzy': 0,
+                         'total': len(to_translate), 'pending': len(to_translate)}
+                files.append(state)
+                for key, langs in to_translate.items():
+                    en = langs.get('en', '')
+                    source = normalize_source(en)
+                    unit = by_source.get(source)
+                    if unit is None:
+                        # 批量JSON以key作为条目标识，不同文件的同名key加后缀区分
+                        unit_key = key if key not in units else f"{key}#{len(units)}"
+                        unit = {'key': unit_key, 'langs': langs, 'en': en, 'targets': [], 'resolved': False,
+                                'cached': tm.get_any(en, ctx['prompt_hash'], ctx['models'])
+                                if skip_existing else None}
+                        by_source[source] = units[unit_key] = unit
+                    unit['targets'].append((state, key))
+
+            # 分批
+            tm_units = [unit for unit in units.values() if unit['cached'] is not None]
+            pending = [(unit['key'], unit['langs']) for unit in units.values() if unit['cached'] is None]
+            # 批次按token预算装填（多条线路取上下文最小的模型），条数上限仍由「单批上限」决定。
+            # 预算按最终的系统消息和用户消息框架计算：术语按全表计，参考译文按与待译条目相当的长度计
+            framing = ctx['glossary_tokens']
+            if pending and len(ctx['fuzzy']):
+                per_item = sum(sum(estimate_item_tokens(key, langs.get('en', ''))) for key, langs in pending)
+                framing += FUZZY_EXAMPLES_PER_BATCH * per_item // len(pending)
+            budgets = [batch_token_budget(spec['model'], ctx['sys_prompt'], framing) for spec in ctx['routes']]
+            budget = (min(b[0] for b in budgets), min(b[1] for b in budgets))
+            ctx['output_budget'] = budget[1]
+            batches = pack_batches(pending, budget, batch_size)
+            key_total = sum(f['total'] for f in files)
+            tm_hits = sum(len(unit['targets']) for unit in tm_units)
+            self._log_translate(
+                f"去重后 {len(units)} 条唯一原文（{key_total} 个key），翻译记忆命中 {tm_hits} 个key，"
+                f"需请求 {len(pending)} 条，按token预算分 {len(batches)} 批（每批≤{batch_size}条）")
+            # 套用翻译记忆
+            for unit in tm_units:
+                self._resolve_unit(ctx, unit, unit['cached'], origin='tm')
+            tasks = [asyncio.ensure_future(run_batch(f"{i+1}/{len(batches)}", batch))
+                     for i, batch in enumerate(batches)]
+            self._log_translate(f"全局队列: {len(files)} 个文件共 {len(tasks)} 批，当前并发 {ctx['limiter'].current}/{concurrency}")
+            watcher = asyncio.ensure_future(self._watch_stop(tasks))
+
+            # 收集结果（结果已逐条写入日志，这里只更新进度、定期刷盘和刷新表格）
+            shown = None
+            last_refresh_time = time.time()
+            for fut in asyncio.as_completed(tasks):
+                try:
+                    await fut
+                except asyncio.CancelledError:
+                    pass
+                if self.translate_stop_event.is_set():
+                    break
+                self._post_total_progress(progress)
+                # 文件进度条显示队列中最靠前的未完成文件
+                current = next((f for f in files if f['pending'] > 0), None)
+                if current is not None:
+                    if current is not shown:
+                        self._ui.post(self.translate_pct_var.set, current['name'])
+                        shown = current
+                    self._ui.post(self.translate_progress_var.set, current['done'] / current['total'] * 100)
+                now = time.time()
+                journal.maybe_sync()
+                # 每5秒刷新一次表格
+                if now - last_refresh_time >= 5 and any(f['name'] == self.current_file for f in files):
+                    self._ui.post(self._refresh_table)
+                    last_refresh_time = now
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*([watcher] if watcher else []), *tasks, return_exceptions=True)
+            for route in routes:
+                await route['client'].close()
+            journal.sync()
+            tm.flush()
+            # 整个任务结束后把日志合并回CSV
+            self._compact_journal()
+
+        total_done = sum(f['done'] for f in files)
+        total_err = sum(f['err'] for f in files)
+        self._log_translate(f"\n翻译结束！成功: {total_done}，跳过: {total_skip}，失败: {total_err}")
+        if ctx['mask_saved']:
+            self._log_translate(f"标签遮蔽: 输入约节省 {ctx['mask_saved']:,} token（估算）")
+        if self.glossary_saved_tokens:
+            self._log_translate(f"术语表按需注入: 输入约节省 {self.glossary_saved_tokens:,} token（估算）")
+        if self.cached_prompt_tokens:
+            rate = self.cached_prompt_tokens / max(1, self.total_prompt_tokens)
+            self._log_translate(f"前缀缓存: 命中 {self.cached_prompt_tokens:,} 输入token ({rate:.0%})")
+        if len(routes) > 1:
+            for line in ctx['limiter'].summary():
+                self._log_translate(f"线路 {line}")
+        self._log_translate(f"Token总计: 输入 {self.total_prompt_tokens:,} | 输出 {self.total_completion_tokens:,} | 合计 {self.total_tokens:,}")
+
+    def _finish_translate_file(self, ctx, state):
+        """某个文件的最后一条有了结果：刷盘、刷新表格并记录日志"""
+        ctx['journal'].sync()
+        if state['name'] == self.current_file:
+            self._ui.post(self._refresh_table)
+        elapsed = time.time() - ctx['job_start']
+        self._log_translate(f"[完成] {state['name']}: 成功 {state['done']}（翻译记忆 {state['tm']}，模糊套用 {state['fuzzy']}），失败 {state['err']}，于开始后 {elapsed:.1f}s 完成")
+
+    async def _chat_completion(self, ctx, **kwargs):
+        """发出一次API请求：选定线路并取得并发名额，等该线路的速率额度后发送，结束后反馈结果
+
+        返回 (响应, 实际使用的模型)。
+        """
+        balancer = ctx['limiter']
+        route, ticket = await balancer.acquire()
+        if route is None:
+            raise RuntimeError("所有线路都已停用")
+        rate = route['rate']
+        # 估算本次消耗：输入 + 与待译内容相当的输出
+        est_tokens = sum(estimate_tokens(m['content']) for m in kwargs['messages'])
+        est_tokens += estimate_tokens(kwargs['messages'][-1]['content'])
+        outcome = None
+        fatal = False
+        t0 = time.time()
+        try:
+            await rate.acquire(est_tokens)
+            t0 = time.time()
+            raw = await route['client'].chat.completions.with_raw_response.create(model=route['model'], **kwargs)
+            rate.observe_headers(raw.headers)
+            resp = raw.parse()
+            usage = getattr(resp, 'usage', None)
+            if usage:
+                rate.settle(est_tokens, getattr(usage, 'total_tokens', 0) or
+                            getattr(usage, 'prompt_tokens', 0) + getattr(usage, 'completion_tokens', 0))
+            outcome = 'ok'
+            return resp, route['model']
+        except Exception as e:
+            outcome = 'overload' if is_overload_error(e) else 'error'
+            headers = getattr(getattr(e, 'response', None), 'headers', None)
+            rate.observe_headers(headers)
+            status = getattr(e, 'status_code', None)
+            if is_route_unusable(e):
+                # 密钥失效/额度用尽或模型有误：这条线路不会再成功，自动停用
+                fatal = True
+                if not route['disabled']:
+                    self._log_translate(f"  [线路] {route['name']} 不可用({status}: {str(e)[:60]})，已停用")
+            elif status == 429:
+                # 被拒绝的请求不计token；按Retry-After暂停这条线路，其余线路照常发送
+                rate.release(tokens=est_tokens)
+                rate.throttled(retry_after_seconds(headers) or 5)
+            raise
+        finally:
+            if balancer.release(route, ticket, outcome, time.time() - t0, fatal=fatal):
+                self._log_translate(f"  [并发] {route['name']} 遇到限频/超时，并发上限降至 {route['limiter'].current}")
+            self._update_token_stats()
+
+    async def _watch_stop(self, tasks):
+        """点击停止后立即取消在途请求，而不是等它们各自超时返回"""
+        while not self.translate_stop_event.is_set():
+            await asyncio.sleep(0.2)
+        for t in tasks:
+            t.cancel()
+
+    def _post_total_progress(self, progress):
+        """更新总进度条"""
+        grand_total = progress['grand_total']
+        if grand_total > 0:
+            done = progress['global_done']
+            pct = done / grand_total * 100
+            self._ui.post(self.translate_total_progress_var.set, pct)
+            self._ui.post(self.translate_total_pct_var.set, f"{done}/{grand_total} ({pct:.0f}%)")
+
+    def _resolve_unit(self, ctx, unit, cn_val, origin='ai', model=None):
+        """一条唯一原文有了结果（cn_val为None表示失败），分发给共享该原文的所有key
+
+        origin: 'ai'=模型译文，'tm'=翻译记忆精确命中，'fuzzy'=模糊匹配改写套用。
+        model: 'ai' 时实际给出译文的模型（按它记入翻译记忆）。
+        事件循环单线程执行，无需加锁。
+        """
+        if unit['resolved']:
+            return
+        unit['resolved'] = True
+        if cn_val is not None:
+            # 去除原文换行，由patch_csv_bytes按用户设置重新换行
+            cn_text = cn_val.replace('\n', '').replace('\r', '').strip()
+            if origin == 'ai':
+                # 只记录模型自己的译文；模糊改写的结果下次仍可从原译文改写得到
+                ctx['tm'].put(unit['en'], ctx['prompt_hash'], model or ctx['model'], cn_text)
+                # 本次新译的结果立即可供后续批次模糊匹配（索引按本次任务的全部模型构建）
+                ctx['fuzzy'].add(unit['en'], cn_text)
+        for state, key in unit['targets']:
+            if cn_val is None:
+                state['err'] += 1
+            else:
+                self.translations.setdefault(state['name'], {})[key] = cn_text
+                state['done'] += 1
+                if origin != 'ai':
+                    state[origin] += 1
+                ctx['progress']['global_done'] += 1
+                self._record_translation(ctx['journal'], state['name'], key, cn_text)
+            state['pending'] -= 1
+            if state['pending'] == 0:
+                self._finish_translate_file(ctx, state)
+
+    def _apply_fuzzy_matches(self, ctx, label, batch_items):
+        """发送前检查模糊匹配：只差数字/占位符的条目直接改写已有译文，返回仍需请求的条目
+
+        轮到该批发送时才检查，前面批次刚译完的结果也能用于后面的批次。
+        """
+        remaining = []
+        applied = 0
+        for key, langs in batch_items:
+            unit = ctx['units'][key]
+            derived = ctx['fuzzy'].derive(unit['en'])
+            if derived is None:
+                remaining.append((key, langs))
+            else:
+                self._resolve_unit(ctx, unit, derived, origin='fuzzy')
+                applied += 1
+        if applied:
+            self._log_translate(f"  [批{label}] 模糊匹配直接套用 {applied} 条")
+        return remaining
+
+    async def _do_translate_batch(self, ctx, label, batch_items):
+        """批量翻译；截断、解析失败或缺key时把失败部分二分后递归重试，直到单条
+
+        一条有问题的文本只多花 O(log n) 次请求，而不是整批逐条重翻。
+        """
+        # 排队等到有并发名额再做模糊匹配
+        limiter = ctx['limiter']
+        await limiter.wait_available()
+        if ctx['reuse_memory'] and not self.translate_stop_event.is_set():
+            batch_items = self._apply_fuzzy_matches(ctx, label, batch_items)
+        if self.translate_stop_event.is_set() or not batch_items:
+            # 不发请求：把这次唤醒让给下一个排队的批次
+            limiter.pass_turn()
+            return
+        failed, reason = await self._request_batch(ctx, label, batch_items)
+        if not failed or self.translate_stop_event.is_set():
+            return
+        if len(batch_items) == 1:
+            self._resolve_unit(ctx, ctx['units'][failed[0][0]], None)
+            self._log_translate(f"    ✗ [批{label}] {failed[0][0]} 翻译失败（{reason}）")
+            return
+        if len(failed) < len(batch_items):
+            # 只有部分key缺失：把缺失的部分作为一个更小的批次重试
+            self._log_translate(f"  [批{label}] {reason}，重试缺失的{len(failed)}条")
+            await self._do_translate_batch(ctx, f"{label}.r", failed)
+            return
+        mid = len(failed) // 2
+        self._log_translate(f"  [批{label}] {reason}，二分重试 {mid}+{len(failed) - mid} 条")
+        await asyncio.gather(
+            self._do_translate_batch(ctx, f"{label}.1", failed[:mid]),
+            self._do_translate_batch(ctx, f"{label}.2", failed[mid:]),
+        )
 
-        threading.Thread(target=worker, daemon=True).start()
+    async def _request_batch(self, ctx, label, batch_items):
+        """发出一次批量请求（网络错误、限频按次重试），返回 (需要拆分重试的条目, 原因)
 
-    def _get_or_create_thread_client(self, ctx):
-        """获取当前线程的独立client（线程本地存储）"""
-        tl = self._thread_local
-        if not hasattr(tl, 'client'):
-            tl.client = self._create_thread_client(ctx['client_config'])
-        return tl.client
-
-    def _do_translate_batch(self, ctx, csv_name, batch_idx, batch_total,
-                            batch_items, done_count, err_count, result_lock, file_total,
-                            global_done=None):
-        """批量翻译：一次API调用翻译多条（每线程独立client）"""
-        if self.translate_stop_event.is_set():
-            return
-        client = self._get_or_create_thread_client(ctx)
-        model = ctx['model']
+        只有截断、解析失败、缺key或标签不完整的条目交给调用方二分重试；
+        请求本身失败（被拒绝或重试用尽）时拆分也无济于事，整批记为失败并返回空列表。
+        """
         temperature = ctx['temperature']
         sys_prompt = ctx['sys_prompt']
-        tid = threading.current_thread().name
-
-        # 构造批量JSON输入
-        input_dict = {key: langs.get('en', '') for key, langs in batch_items}
-        batch_json = json.dumps(input_dict, ensure_ascii=False)
-        user_msg = (
-            "请将以下JSON中的英文值翻译为中文，保持key不变，直接返回翻译后的JSON。"
-            f"不要添加任何解释或markdown格式。\n{batch_json}"
-        )
+
+        # 构造批量JSON输入：标签替换为 <1> 等短标记，返回后校验并还原
+        sources = {key: langs.get('en', '') for key, langs in batch_items}
+        input_dict = {}
+        masks = {}
+        for key, en in sources.items():
+            input_dict[key], masks[key] = mask_tags(en)
+            if masks[key]:
+                ctx['mask_saved'] += estimate_tokens(en) - estimate_tokens(input_dict[key])
+        # 用户消息只放本批可变内容，待翻译JSON放在最后；固定要求已在系统消息中
+        parts = []
+        glossary = ctx['glossary']
+        if glossary is not None:
+            terms = glossary.select(sources.values())
+            block = format_glossary(terms) if terms else ''
+            self._update_token_stats(glossary_saved=ctx['glossary_tokens'] - estimate_tokens(block))
+            if block:
+                parts.append(block)
+        # 附上相似原文的已有译文作为参考，保持术语和句式一致
+        examples = {}
+        for en in sources.values():
+            for _, ref_en, ref_text in ctx['fuzzy'].similar(en):
+                if len(examples) < FUZZY_EXAMPLES_PER_BATCH:
+                    examples.setdefault(ref_en, ref_text)
+        if examples:
+            parts.append(f"## 相似原文的已有译文（仅供参考）\n{json.dumps(examples, ensure_ascii=False)}")
+        parts.append(f"## 待翻译\n{json.dumps(input_dict, ensure_ascii=False)}")
+        user_msg = '\n\n'.join(parts)
+        # 输出上限取装批时的输出预算；单条就超出预算的批次按其估算放宽，避免必然截断
+        max_tokens = max(ctx['output_budget'],
+                         sum(estimate_item_tokens(key, en)[1] for key, en in sources.items()))
 
         for attempt in range(4):
             if self.translate_stop_event.is_set():
-                return
+                return [], ''
             try:
                 t0 = time.time()
-                resp = client.chat.completions.create(
-                    model=model,
+                resp, model = await self._chat_completion(
+                    ctx,
                     messages=[
                         {"role": "system", "content": sys_prompt},
                         {"role": "user", "content": user_msg},
                     ],
                     temperature=temperature,
-                    max_tokens=16384,
+                    max_tokens=max_tokens,
                 )
-                api_elapsed = time.time() - t0
-                raw_content = resp.choices[0].message.content or ''
-                # 统计token
-                usage = getattr(resp, 'usage', None)
-                p_tok = getattr(usage, 'prompt_tokens', 0) if usage else 0
-                c_tok = getattr(usage, 'completion_tokens', 0) if usage else 0
-                if usage:
-                    self._update_token_stats(p_tok, c_tok)
-
-                # 检测截断：finish_reason为length表示输出被token上限截断
-                finish_reason = getattr(resp.choices[0], 'finish_reason', None)
-                if finish_reason == 'length':
-                    self._log_translate(f"  [批{batch_idx+1}] 响应被截断(finish_reason=length)，回退逐条翻译")
-                    for key, langs in batch_items:
-                        if self.translate_stop_event.is_set():
-                            return
-                        self._do_translate_single(
-                            ctx, csv_name, key, langs,
-                            done_count, err_count, result_lock, file_total,
-                            global_done,
-                        )
-                    return
-
-                # 使用json_repair解析（比json.loads更健壮）
-                result_dict = json_repair.loads(raw_content.strip())
-                if not isinstance(result_dict, dict):
-                    raise ValueError(f"LLM返回非dict类型: {type(result_dict)}")
-
-                # key修正：LLM可能"纠正"key拼写，按顺序映射回原始key
-                input_keys = list(input_dict.keys())
-                returned_keys = list(result_dict.keys())
-                unmatched = [k for k in returned_keys if k not in input_dict]
-                if unmatched and len(returned_keys) == len(input_keys):
-                    # 返回数量一致但key不同，按顺序映射
-                    remapped = {}
-                    for orig_k, ret_k in zip(input_keys, returned_keys):
-                        remapped[orig_k] = result_dict[ret_k]
-                    result_dict = remapped
-
-                # 更新翻译结果（锁内只做dict更新，不做I/O）
-                batch_done = 0
-                with result_lock:
-                    if csv_name not in self.translations:
-                        self.translations[csv_name] = {}
-                    for key, cn_val in result_dict.items():
-                        if key in input_dict and cn_val and isinstance(cn_val, str):
-                            # 去除原文换行，由patch_csv_bytes按用户设置重新换行
-                            self.translations[csv_name][key] = cn_val.replace('\n', '').replace('\r', '').strip()
-                            done_count[0] += 1
-                            batch_done += 1
-                            if global_done is not None:
-                                global_done[0] += 1
-                    pct = done_count[0] / file_total * 100
-                    self.root.after(0, lambda p=pct: self.translate_progress_var.set(p))
-
-                missing = [k for k, _ in batch_items if k not in result_dict]
-                if missing:
-                    with result_lock:
-                        err_count[0] += len(missing)
-                    # 诊断日志：显示期望key与实际返回key的差异
-                    expected_keys = [k for k, _ in batch_items]
-                    returned_keys = list(result_dict.keys())
-                    self._log_translate(
-                        f"    ⚠ 缺失{len(missing)}条 期望key: {expected_keys[:5]}... 返回key: {returned_keys[:5]}..."
-                    )
-                    if batch_done == 0:
-                        self._log_translate(f"    ⚠ LLM原始返回(前200字): {raw_content[:200]}")
-
-                self._log_translate(
-                    f"  [{tid}][批{batch_idx+1}/{batch_total}] {batch_done}/{len(batch_items)}条OK  {api_elapsed:.1f}s (token:{p_tok}+{c_tok})"
-                )
-                return
             except Exception as e:
                 err_str = str(e)
-                is_rate = '429' in err_str or 'rate' in err_str.lower()
+                status = getattr(e, 'status_code', None)
+                balancer = ctx['limiter']
+                unusable = is_route_unusable(e)
+                if unusable and balancer.active():
+                    # 这条线路已停用，换其余线路重试
+                    continue
+                if unusable or not balancer.active():
+                    # 所有线路的密钥/模型都不可用，拆分重试也没用
+                    self._log_translate(f"  [批{label}] 请求被拒绝: {err_str[:80]}")
+                    self._fail_batch(ctx, batch_items)
+                    return [], ''
                 if attempt == 3:
-                    # 最终失败：回退逐条翻译
-                    self._log_translate(f"  [批{batch_idx+1}] 批量失败，回退逐条: {err_str[:80]}")
-                    for key, langs in batch_items:
-                        if self.translate_stop_event.is_set():
-                            return
-                        self._do_translate_single(
-                            ctx, csv_name, key, langs,
-                            done_count, err_count, result_lock, file_total,
-                            global_done,
-                        )
-                    return
-                elif is_rate:
-                    m = re.search(r'after\s+(\d+)\s*second', err_str)
-                    wait = int(m.group(1)) + 1 if m else 5 * (attempt + 1)
-                    self._log_translate(f"  [批{batch_idx+1}] 限频等待{wait}s...")
-                    time.sleep(wait)
+                    # 网络错误、5xx、超时：已重试4次，整批记为失败而不是拆成更多请求
+                    self._log_translate(f"  [批{label}] 请求失败，整批{len(batch_items)}条记为失败: {err_str[:80]}")
+                    self._fail_batch(ctx, batch_items)
+                    return [], ''
+                if status == 429:
+                    # 等待时间已登记到限速器，重试发送前由它统一等待
+                    self._log_translate(f"  [批{label}] 限频，{balancer.blocked_for():.0f}s后重试...")
                 else:
-                    time.sleep(2 ** attempt)
-
-    def _do_translate_single(self, ctx, csv_name, key, langs,
-                             done_count, err_count, result_lock, file_total,
-                             global_done=None):
-        """单条翻译回退（每线程独立client）"""
-        client = self._get_or_create_thread_client(ctx)
-        model = ctx['model']
-        en = langs.get('en', '')
-        user_msg = f"KEY: {key}\nEnglish: {en}\n\n请翻译为中文（只输出翻译结果）："
-        for attempt in range(3):
-            if self.translate_stop_event.is_set():
-                return
-            try:
-                resp = client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": ctx['sys_prompt']},
-                        {"role": "user", "content": user_msg},
-                    ],
-                    temperature=ctx['temperature'],
-                    max_tokens=4096,
+                    await asyncio.sleep(2 ** attempt)
+                continue
+
+            api_elapsed = time.time() - t0
+            raw_content = resp.choices[0].message.content or ''
+            # 统计token
+            usage = getattr(resp, 'usage', None)
+            p_tok = getattr(usage, 'prompt_tokens', 0) if usage else 0
+            c_tok = getattr(usage, 'completion_tokens', 0) if usage else 0
+            cached = cached_prompt_tokens(usage) if usage else 0
+            if usage:
+                self._update_token_stats(p_tok, c_tok, cached_tokens=cached)
+
+            # 检测截断：finish_reason为length表示输出被token上限截断
+            if getattr(resp.choices[0], 'finish_reason', None) == 'length':
+                return batch_items, "响应被截断(finish_reason=length)"
+
+            # 使用json_repair解析（比json.loads更健壮）
+            result_dict = json_repair.loads(raw_content.strip())
+            if not isinstance(result_dict, dict):
+                self._log_translate(f"    ⚠ LLM原始返回(前200字): {raw_content[:200]}")
+                return batch_items, f"返回非JSON对象({type(result_dict).__name__})"
+
+            # key修正：LLM可能"纠正"key拼写，按顺序映射回原始key
+            input_keys = list(input_dict.keys())
+            returned_keys = list(result_dict.keys())
+            unmatched = [k for k in returned_keys if k not in input_dict]
+            if unmatched and len(returned_keys) == len(input_keys):
+                # 返回数量一致但key不同，按顺序映射
+                remapped = {}
+                for orig_k, ret_k in zip(input_keys, returned_keys):
+                    remapped[orig_k] = result_dict[ret_k]
+                result_dict = remapped
+
+            # 更新翻译结果；标签标记丢失或重复的条目与缺失的一样重新排队
+            batch_done = 0
+            broken = 0
+            failed = []
+            for key, langs in batch_items:
+                cn_val = result_dict.get(key)
+                if not (cn_val and isinstance(cn_val, str) and cn_val.strip()):
+                    failed.append((key, langs))
+                    continue
+                cn_val = unmask_tags(cn_val, masks[key])
+                if cn_val is None:
+                    broken += 1
+                    failed.append((key, langs))
+                    continue
+                self._resolve_unit(ctx, ctx['units'][key], cn_val, model=model)
+                batch_done += 1
+
+            self._log_translate(
+                f"  [批{label}] {batch_done}/{len(batch_items)}条OK  {api_elapsed:.1f}s (token:{p_tok}+{c_tok})"
+            )
+            if failed and batch_done == 0:
+                # 诊断日志：显示期望key与实际返回key的差异
+                self._log_translate(
+                    f"    ⚠ 期望key: {input_keys[:5]}... 返回key: {list(result_dict.keys())[:5]}..."
                 )
-                raw = resp.choices[0].message.content or ''
-                # 检测单条截断
-                finish_reason = getattr(resp.choices[0], 'finish_reason', None)
-                if finish_reason == 'length' and attempt < 2:
-                    raise Exception("单条响应被截断，重试")
-                result = raw.strip().strip('"').strip("'")
-                for prefix in ['翻译：', '翻译:', '中文翻译：', '中文：', '中文:', '翻译结果：', '翻译结果:']:
-                    if result.startswith(prefix):
-                        result = result[len(prefix):].strip()
-                usage = getattr(resp, 'usage', None)
-                if usage:
-                    self._update_token_stats(
-                        getattr(usage, 'prompt_tokens', 0),
-                        getattr(usage, 'completion_tokens', 0))
-                if result.strip():
-                    with result_lock:
-                        if csv_name not in self.translations:
-                            self.translations[csv_name] = {}
-                        # 去除原文换行，由patch_csv_bytes按用户设置重新换行
-                        self.translations[csv_name][key] = result.replace('\n', '').replace('\r', '').strip()
-                        done_count[0] += 1
-                        if global_done is not None:
-                            global_done[0] += 1
-                        pct = done_count[0] / file_total * 100
-                        self.root.after(0, lambda p=pct: self.translate_progress_var.set(p))
-                    return
-            except Exception:
-                time.sleep(2 ** attempt)
-        with result_lock:
-            err_count[0] += 1
+            reason = f"缺失{len(failed) - broken}条"
+            if broken:
+                reason = f"{reason}、标签不完整{broken}条" if len(failed) > broken else f"标签不完整{broken}条"
+            return failed, reason
+        self._log_translate(f"  [批{label}] 请求失败，整批{len(batch_items)}条记为失败")
+        self._fail_batch(ctx, batch_items)
+        return [], ''
+
+    def _fail_batch(self, ctx, batch_items):
+        """本批条目全部记为失败"""
+        for key, _ in batch_items:
+            self._resolve_unit(ctx, ctx['units'][key], None)
 
     def _auto_save_translations(self, csv_name):
-        """自动保存翻译结果到CSV（schinese列）"""
+        """自动保存翻译结果到CSV（schinese列）
+
+        后台线程调用时先等待导出完成；主线程调用前须用 _defer_until_exported 确认没有导出在进行。
+        """
+        self._wait_for_export()
         csv_dir = self._get_csv_dir()
         csv_path = os.path.join(csv_dir, csv_name)
         if not os.path.isfile(csv_path):
-            return
+            return False
         trans = self.translations.get(csv_name, {})
         if not trans:
-            return
+            return True
         try:
             with open(csv_path, 'rb') as f:
                 raw_bytes = f.read()
@@ -1701,9 +4345,168 @@ class TranslationToolApp:
             with open(tmp, 'wb') as f:
                 f.write(patched_bytes)
             os.replace(tmp, csv_path)
+            self._mark_csv_written(csv_path)
+            return True
+        except Exception:
+            return False
+
+    # ---------- 翻译日志 ----------
+
+    def _get_journal(self):
+        """获取当前CSV目录对应的翻译日志"""
+        path = os.path.join(self._get_csv_dir(), JOURNAL_NAME)
+        with self._journal_lock:
+            if self._journal is None or self._journal.path != path:
+                if self._journal is not None:
+                    self._journal.close()
+                self._journal = TranslationJournal(path)
+            return self._journal
+
+    def _get_translation_memory(self):
+        """获取当前CSV目录对应的翻译记忆"""
+        path = os.path.join(self._get_csv_dir(), TM_NAME)
+        with self._journal_lock:
+            if self._tm is None or self._tm.path != path:
+                if self._tm is not None:
+                    self._tm.close()
+                self._tm = TranslationMemory(path)
+            return self._tm
+
+    def _source_text(self, csv_name, key, default=''):
+        """某条的英文原文；文件尚未解析时不触发整表解析"""
+        if csv_name not in self.all_data:
+            return default
+        if isinstance(self.all_data, LazyCorpus):
+            return self.all_data.text_of(csv_name, key, 'en', default)
+        return self.all_data[csv_name].get_text(key, 'en', default)
+
+    def _record_translation(self, journal, csv_name, key, text):
+        """把一条已接受的翻译追加到日志（O(1)持久化，替代整文件重写）
+
+        journal 在开始翻译时由主线程解析好（ctx['journal']）：逐条追加时不读取界面变量、不访问目录。
+        """
+        en = self._source_text(csv_name, key)
+        try:
+            journal.append(csv_name, key, text, source_hash(en))
         except Exception:
             pass
 
+    def _replay_journal(self):
+        """重放本次启动之前留下的未合并记录，返回应用的条数
+
+        本次运行追加的记录早已在内存中，不再重放（以免覆盖之后的手动编辑）。
+        """
+        applied = 0
+        for rec in self._get_journal().replay():
+            if rec.get('ts', 0) >= self._started:
+                continue
+            csv_name, key = rec['file'], rec['key']
+            en = self._source_text(csv_name, key, None)
+            # 英文原文已变化（游戏更新）的旧翻译不再恢复
+            if en is not None and rec.get('src') and rec['src'] != source_hash(en):
+                continue
+            self.translations.setdefault(csv_name, {})[key] = rec['text']
+            applied += 1
+        return applied
+
+    def _compact_journal(self, progress=None):
+        """把日志中涉及的文件合并回CSV的schinese列，成功后清空日志（后台线程调用）
+
+        progress(i, n, csv_name)：每合并一个文件前回调。
+        """
+        with self._compact_lock:
+            journal = self._get_journal()
+            files = journal.rotate()
+            ok = True
+            for i, csv_name in enumerate(sorted(files), 1):
+                if progress:
+                    progress(i, len(files), csv_name)
+                if not self._auto_save_translations(csv_name):
+                    ok = False
+            if ok:
+                journal.discard_rotated()
+            return len(files)
+
+    def _recover_journal(self, progress=None):
+        """有未合并的日志记录时先重放再合并回CSV（后台线程调用），返回合并的文件数
+
+        读取GPAK、启动、刷新补丁列表和打补丁前调用：崩溃后日志里的结果不会漏出补丁。
+        """
+        if self._get_journal().is_empty():
+            return 0
+        self._replay_journal()
+        return self._compact_journal(progress)
+
+    def _compact_in_background(self, on_done, recover=False):
+        """在后台线程合并翻译日志（先等CSV导出完成），进度显示在状态栏，结束后在主线程调用 on_done(文件数)
+
+        recover=True 时先重放早于本次启动的记录（见 _recover_journal）。
+        """
+        def progress(i, n, csv_name):
+            self._ui.post(self.status_var.set, f"正在合并翻译日志 {i}/{n}: {csv_name}")
+
+        def worker():
+            count = 0
+            try:
+                self._wait_for_export()
+                if recover:
+                    count = self._recover_journal(progress)
+                else:
+                    count = self._compact_journal(progress)
+            except Exception as e:
+                self._ui.post(self.status_var.set, f"合并翻译日志失败: {e}")
+            self._ui.post(on_done, count)
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _recover_in_background(self, on_done):
+        """主线程调用：后台重放并合并未合并的日志，同一时间只跑一个，结束后在主线程调用 on_done(文件数)"""
+        if self._recovering:
+            return
+        self._recovering = True
+
+        def done(count):
+            self._recovering = False
+            on_done(count)
+
+        self._compact_in_background(done, recover=True)
+
+    def _save_journal_now(self):
+        """手动保存：把翻译日志合并到CSV（后台进行，界面不卡顿）"""
+        csv_dir = self._get_csv_dir()
+        self.status_var.set("正在合并翻译日志...")
+        self._compact_in_background(
+            lambda count: self.status_var.set(f"已将翻译日志合并到 {count} 个CSV文件 ({csv_dir})"))
+
+    def _on_close(self):
+        """退出前停止翻译；日志中有未合并的记录时先在后台合并，完成后再关闭窗口"""
+        if self._closing:
+            return
+        self.translate_stop_event.set()
+        if self._defer_until_exported(self._on_close, "CSV导出尚未完成，完成后自动退出..."):
+            return
+        journal = self._journal
+        try:
+            pending = journal is not None and not journal.is_empty()
+        except Exception:
+            pending = False
+        if pending:
+            self._closing = True
+            self.status_var.set("正在保存翻译日志，完成后自动退出...")
+            self._compact_in_background(lambda count: self._finish_close())
+            return
+        self._finish_close()
+
+    def _finish_close(self):
+        if self._journal is not None:
+            try:
+                self._journal.close()
+            except Exception:
+                pass
+        if self._tm is not None:
+            self._tm.close()
+        self.root.destroy()
+
     def _stop_translate(self):
         self.translate_stop_event.set()
         self._log_translate("[用户中断] 正在停止翻译...")
@@ -1856,13 +4659,64 @@ class TranslationToolApp:
         
         threading.Thread(target=do_convert, daemon=True).start()
 
+    def _lint_wrap(self):
+        """检查所有译文换行后是否超宽、无法断行或标签异常（只重新检查改动过的行）"""
+        if self._lint_running:
+            return
+        if not self.translations:
+            messagebox.showwarning("提示", "没有可检查的翻译")
+            return
+        try:
+            wrap_chars = int(self.wrap_width_var.get()) if hasattr(self, 'wrap_width_var') else 15
+        except (ValueError, TypeError):
+            wrap_chars = 15
+        wrap_width = wrap_chars * 2 if wrap_chars > 0 else None
+        translations = {fname: dict(trans) for fname, trans in self.translations.items() if trans}
+        self._lint_running = True
+        self._log_patch(f"开始检查换行... (换行字数: {wrap_chars})")
+
+        def worker():
+            try:
+                if wrap_width is not None:
+                    self._ensure_char_widths(self._log_patch)
+                t0 = time.time()
+                issues, checked = self._wrap_linter.check(translations, wrap_width,
+                                                          normalize_punct=self._normalize_punct())
+                total = sum(len(t) for t in translations.values())
+                self._log_patch(f"  检查 {checked} 行（其余 {total - checked} 行未改动，沿用上次结果），"
+                                f"耗时 {time.time() - t0:.1f}s")
+                counts = {}
+                for issue in issues:
+                    counts[issue[2]] = counts.get(issue[2], 0) + 1
+                if not issues:
+                    self._log_patch("✅ 没有发现问题")
+                    return
+                self._log_patch("  " + "，".join(f"{LINT_KINDS[k]} {n} 处" for k, n in counts.items()))
+                report_path = os.path.join(self._get_csv_dir(), LINT_REPORT_NAME)
+                with open(report_path, 'w', encoding='utf-8') as f:
+                    for fname, key, kind, no, detail in issues:
+                        f.write(f"{fname}\t{key}\t{LINT_KINDS[kind]}\t{no}\t{detail}\n")
+                shown = issues[:200]
+                for fname, key, kind, no, detail in shown:
+                    where = f"第{no}行 " if no else ""
+                    self._log_patch(f"  [{LINT_KINDS[kind]}] {fname} {key} {where}{detail}")
+                if len(issues) > len(shown):
+                    self._log_patch(f"  ……另有 {len(issues) - len(shown)} 处")
+                self._log_patch(f"  完整报告: {report_path}")
+            except Exception as e:
+                self._log_patch(f"[错误] 换行检查失败: {e}")
+            finally:
+                self._lint_running = False
+
+        threading.Thread(target=worker, daemon=True).start()
+
     def _log_patch(self, msg):
         def _do():
             self.patch_log.configure(state='normal')
             self.patch_log.insert('end', msg + '\n')
             self.patch_log.see('end')
             self.patch_log.configure(state='disabled')
-        self.root.after(0, _do)
+        self._ui.post(_do)
 
     def _browse_csv_dir(self):
         path = filedialog.askdirectory(title="选择CSV文件目录")
@@ -1870,8 +4724,11 @@ class TranslationToolApp:
             self.csv_dir_var.set(path)
             self._refresh_patch_files()
 
-    def _refresh_patch_files(self):
-        """刷新补丁页的CSV文件列表（同时重新加载翻译数据）"""
+    def _refresh_patch_files(self, recover=True):
+        """刷新补丁页的CSV文件列表（同时重新加载翻译数据）
+
+        该目录的翻译日志有未合并记录时先在后台重放并合并，完成后再刷新一次。
+        """
         for w in self.patch_file_inner.winfo_children():
             w.destroy()
         self.patch_file_vars.clear()
@@ -1879,6 +4736,13 @@ class TranslationToolApp:
         if not csv_dir or not os.path.isdir(csv_dir):
             ttk.Label(self.patch_file_inner, text="请先加载游戏数据或设置CSV目录", foreground='gray').pack(pady=5)
             return
+        if recover:
+            try:
+                pending = not self._get_journal().is_empty()
+            except OSError:
+                pending = False
+            if pending:
+                self._recover_in_background(lambda count: self._refresh_patch_files(recover=False))
         # 从CSV文件重新加载已有翻译
         self._load_translations_from_csvs(csv_dir)
         csv_files = sorted(f for f in os.listdir(csv_dir) if f.endswith('.csv'))
@@ -1930,6 +4794,11 @@ class TranslationToolApp:
         def worker():
             try:
                 gpak_path = os.path.join(game_dir, "resources.gpak")
+                self._wait_for_export()
+                # 先把未合并的翻译日志重放并合并，补丁按完整的翻译生成
+                merged = self._recover_journal()
+                if merged:
+                    self._log_patch(f"已合并翻译日志到 {merged} 个CSV文件")
 
                 # 读取GPAK索引
                 self._log_patch("读取GPAK索引...")
@@ -1945,8 +4814,15 @@ class TranslationToolApp:
                     wrap_chars = 15
                 wrap_width = wrap_chars * 2 if wrap_chars > 0 else None
                 self._log_patch(f"  换行字数: {wrap_chars}（{'不换行' if wrap_width is None else f'显示宽度{wrap_width}'}）")
+                if wrap_width is not None:
+                    self._ensure_char_widths(self._log_patch)
                 selected_set = set(csv_files)
+                # 勾选打补丁的文件此时才解析（懒加载）
+                if isinstance(self.all_data, LazyCorpus):
+                    self.all_data.load(csv_files)
                 patch_files = {}
+                jobs = []
+                job_names = []
                 for entry in entries:
                     name = entry['name']
                     if not name.startswith('data/text/') or not name.endswith('.csv'):
@@ -1956,23 +4832,26 @@ class TranslationToolApp:
                         continue
                     csv_path = os.path.join(csv_dir, csv_name)
                     if os.path.isfile(csv_path):
-                        with open(csv_path, 'rb') as f:
-                            raw_bytes = f.read()
-                        # 获取该文件的翻译（去除换行的纯文本）
-                        trans = self.translations.get(csv_name, {})
-                        # 去除翻译中残留的换行
-                        clean_trans = {}
-                        for k, v in trans.items():
-                            clean_trans[k] = v.replace('\n', '').replace('\r', '') if isinstance(v, str) else v
-                        # 通过patch_csv_bytes重新写入schinese列（含自动换行）
-                        patched_bytes, cnt = patch_csv_bytes(raw_bytes, clean_trans, CN_TARGET_LANG, wrap_width)
-                        # 写回CSV文件
-                        with open(csv_path, 'wb') as f:
-                            f.write(patched_bytes)
-                        patch_files[name] = patched_bytes
-                        self._log_patch(f"  {csv_name} ({cnt}条翻译)")
-
-                self._log_patch(f"  共替换 {len(patch_files)} 个CSV文件")
+                        jobs.append((csv_path, self.translations.get(csv_name, {})))
+                        job_names.append(name)
+
+                # 译文经流水线（去除残留换行→清理→[标点]→自动换行）写入schinese列并写回CSV，多文件时并行
+                pipeline = self._patch_pipeline(wrap_width)
+                targets = self._patch_targets(pipeline, wrap_width, self._log_patch)
+                t0 = time.time()
+                results = patch_csv_files(jobs, targets, WRAP_CACHE)
+                for name, (csv_path, _), (patched_bytes, cnt, elapsed) in zip(job_names, jobs, results):
+                    self._mark_csv_written(csv_path)
+                    patch_files[name] = patched_bytes
+                    self._log_patch(f"  {os.path.basename(name)} ({cnt}条翻译, {elapsed * 1000:.0f}ms)")
+
+                self._log_patch(f"  共替换 {len(patch_files)} 个CSV文件，耗时 {time.time() - t0:.1f}s")
+                hits, misses = WRAP_CACHE.take_stats()
+                self._log_patch(f"  换行: 重新处理 {misses} 条，缓存命中 {hits} 条")
+                for lang, target_pipeline in targets:
+                    if target_pipeline is pipeline and lang != CN_TARGET_LANG:
+                        continue  # 与schinese共用处理结果
+                    self._log_patch(f"  {lang} 各阶段耗时: {target_pipeline.format_timings()}")
 
                 # 字体替换
                 font_swf_path = self.font_swf_var.get().strip()
@@ -2122,4 +5001,7 @@ def main():
 
 
 if __name__ == '__main__':
+    # PyInstaller打包后进程池需要
+    import multiprocessing
+    multiprocessing.freeze_support()
     main()